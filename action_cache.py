@@ -0,0 +1,131 @@
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import hashlib
+import argparse
+import subprocess
+
+# 'generate.py --action-cache' copies this file into the generated tree and
+# runs the GYP actions through it, e.g.:
+#
+#     python ncg_action_cache.py --cache=DIR --build-dir=DIR \
+#            --inputs IN... --outputs OUT... -- ACTION...
+#
+# The outputs of an action are cached in 'DIR' (or in the directory named by
+# the 'NCG_ACTION_CACHE' environment variable), keyed by the action, its
+# outputs and the contents of its inputs, so that build trees sharing the
+# cache only run each action once.  Without a cache directory the action is
+# always run.
+
+VERSION   = 1
+BUILD_DIR = '<build>'
+COMPLETE  = 'complete'
+
+def normalize(argument, build_dir):
+    if build_dir:
+        return argument.replace(build_dir, BUILD_DIR)
+    return argument
+
+def get_file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_key(command, inputs, outputs, build_dir):
+    '''
+    Return the cache key of running 'command' to produce 'outputs' from
+    'inputs', independent of the build directory.
+    '''
+    key = hashlib.sha256()
+    key.update('ncg-action-cache {}\n'.format(VERSION).encode('utf-8'))
+    for argument in command:
+        key.update('argument {}\n'.format(normalize(argument, build_dir)).encode('utf-8'))
+    for output in outputs:
+        key.update('output {}\n'.format(normalize(output, build_dir)).encode('utf-8'))
+    for path in inputs:
+        digest = get_file_digest(path) if os.path.isfile(path) else 'missing'
+        key.update('input {} {}\n'.format(normalize(path, build_dir),
+                                          digest).encode('utf-8'))
+    return key.hexdigest()
+
+def make_parent_directory(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+def restore(entry, outputs):
+    if not os.path.isfile(os.path.join(entry, COMPLETE)):
+        return False
+
+    for index, output in enumerate(outputs):
+        make_parent_directory(output)
+        shutil.copyfile(os.path.join(entry, str(index)), output)
+
+        # The restored output must be newer than the inputs of the action.
+        os.utime(output, None)
+    return True
+
+def save(entry, outputs):
+    staging = '{}.{}.tmp'.format(entry, os.getpid())
+    os.makedirs(staging)
+    try:
+        for index, output in enumerate(outputs):
+            shutil.copyfile(output, os.path.join(staging, str(index)))
+        with open(os.path.join(staging, COMPLETE), 'w'):
+            pass
+        os.rename(staging, entry)
+    except OSError:
+        # Another build saved the same entry first.
+        pass
+    finally:
+        if os.path.isdir(staging):
+            shutil.rmtree(staging)
+
+def parse_args(arguments):
+    if '--' not in arguments:
+        raise RuntimeError('Expected -- before the command')
+
+    separator = arguments.index('--')
+    parser    = argparse.ArgumentParser(
+                            description='Run a GYP action, restoring its '
+                                        'outputs from a cache if possible.')
+    parser.add_argument('--cache',
+                        help='directory in which outputs are cached')
+    parser.add_argument('--build-dir',
+                        help='build directory, ignored in cache keys')
+    parser.add_argument('--inputs', nargs='*', default=[])
+    parser.add_argument('--outputs', nargs='*', default=[])
+    options         = parser.parse_args(arguments[:separator])
+    options.command = arguments[separator + 1:]
+    return options
+
+def main():
+    options = parse_args(sys.argv[1:])
+    cache   = options.cache or os.environ.get('NCG_ACTION_CACHE')
+    if not cache or len(options.outputs) == 0:
+        return subprocess.call(options.command)
+
+    key   = get_key(options.command,
+                    options.inputs,
+                    options.outputs,
+                    options.build_dir)
+    entry = os.path.join(cache, key[:2], key)
+    if restore(entry, options.outputs):
+        return 0
+
+    result = subprocess.call(options.command)
+    if result == 0 and all(os.path.isfile(o) for o in options.outputs):
+        make_parent_directory(entry)
+        save(entry, options.outputs)
+    return result
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,8 +2,20 @@ import os
 import sys
 import json
 
+import stats
+import store
+
 GENERATED = '${CMAKE_BINARY_DIR}/ncg_generated'
-ANALYSIS_FILE = './gyp_analysis.json'
+ANALYSIS_FILE          = './gyp_analysis.json'
+ANALYSIS_PLATFORM_FILE = './gyp_analysis.{}.json'
+ANALYSIS_STORE         = './gyp_analysis'
+
+# 'NCG_STATS=FILE' records the time spent in each phase of the analysis and
+# counts describing each target in FILE, under the name of the platform, and
+# 'NCG_PROFILE=FILE' writes cProfile statistics of the analysis to
+# 'FILE.<platform>'.
+STATS_VARIABLE   = 'NCG_STATS'
+PROFILE_VARIABLE = 'NCG_PROFILE'
 
 def get_OS():
     if sys.platform == 'darwin':
@@ -128,23 +140,95 @@ def analyze(targets):
         'all_generated_sources': all_generated_sources,
     }
 
-def GenerateOutput(names, targets, data, params):
-    targets = normalize_target_paths(targets, params['cwd'])
+def get_target_counts(target):
+    configurations = target.get('configurations', {}).values()
 
-    analysis_data = {}
-    if os.path.isfile(ANALYSIS_FILE):
-        with open(ANALYSIS_FILE, 'r') as f:
-            analysis_data = json.load(f)
+    def count(*fields):
+        return sum(len(configuration.get(field, [])) \
+                   for configuration in configurations \
+                   for field in fields)
 
-    analysis_data[sys.platform] = {
+    return {
+        'sources':       len(target.get('sources', [])),
+        'actions':       len(target.get('actions', [])),
+        'dependencies':  len(set(target.get('dependencies', []))),
+        'compile_flags': count('cflags', 'cflags_c', 'cflags_cc'),
+        'defines':       count('defines'),
+        'include_dirs':  count('include_dirs'),
+        'link_flags':    count('libraries', 'ldflags'),
+    }
+
+def write_analysis(targets, params, statistics):
+    with statistics.phase('normalize/{}'.format(sys.platform)):
+        targets = normalize_target_paths(targets, params['cwd'])
+
+    with statistics.phase('analyze/{}'.format(sys.platform)):
+        analysis = analyze(targets)
+
+    if os.environ.get(STATS_VARIABLE):
+        for name, target in targets.iteritems():
+            statistics.count(sys.platform, name, get_target_counts(target))
+
+    with statistics.phase('write/{}'.format(sys.platform)):
+        write_platform(targets, analysis, params)
+
+def write_platform(targets, analysis, params):
+    # '-G ncg_format=sharded' writes a store with one file per target instead
+    # of a single file for all platforms, and '-G ncg_compress=1' compresses
+    # each file in the store.  '-G ncg_format=split' writes a separate file for
+    # this platform, to be combined with the other platforms by 'merge.py'.
+    flags = params.get('generator_flags', {})
+    output_format = flags.get('ncg_format', 'json')
+    if output_format == 'sharded':
+        store.write_platform(ANALYSIS_STORE,
+                             sys.platform,
+                             targets,
+                             analysis,
+                             compress=bool(int(flags.get('ncg_compress', 0))),
+                             cls=AnalysisEncoder)
+        return
+
+    platform_data = {
         'targets'  : targets,
-        'analysis' : analyze(targets)
+        'analysis' : analysis
     }
 
-    with open(ANALYSIS_FILE, 'w') as f:
-        json.dump(analysis_data, f,
-                  sort_keys=True,
-                  separators=(',', ': '),
-                  indent=4,
-                  cls=AnalysisEncoder)
+    if output_format == 'split':
+        store.dump_json({sys.platform: platform_data},
+                        ANALYSIS_PLATFORM_FILE.format(sys.platform),
+                        cls=AnalysisEncoder,
+                        pretty=True)
+        return
+
+    if output_format != 'json':
+        raise RuntimeError('Unknown analysis format: {}'.format(output_format))
+
+    # Analyses of several platforms may share the same directory, so the
+    # read-modify-write of the combined file happens under a lock and the
+    # file is replaced atomically.
+    with store.locked(ANALYSIS_FILE):
+        analysis_data = {}
+        if os.path.isfile(ANALYSIS_FILE):
+            with open(ANALYSIS_FILE, 'r') as f:
+                analysis_data = json.load(f)
+
+        analysis_data[sys.platform] = platform_data
+        store.dump_json(analysis_data,
+                        ANALYSIS_FILE,
+                        cls=AnalysisEncoder,
+                        pretty=True)
 
+def GenerateOutput(names, targets, data, params):
+    statistics = stats.Stats()
+    profile    = os.environ.get(PROFILE_VARIABLE)
+    with stats.profiled(profile and '{}.{}'.format(profile, sys.platform)):
+        write_analysis(targets, params, statistics)
+
+    path = os.environ.get(STATS_VARIABLE)
+    if path:
+        # Like the analysis, the reports of all platforms are merged into the
+        # same file.
+        with store.locked(path):
+            if os.path.isfile(path):
+                statistics.update(store.load_json(path))
+            statistics.dump(path)
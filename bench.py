@@ -0,0 +1,299 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from collections import OrderedDict
+from distutils.spawn import find_executable
+
+import analyse
+import generate
+import model
+import stats
+import store
+
+# The code generator run by the synthetic actions, which writes each output.
+GENERATOR = '''import os, sys
+for path in sys.argv[1:]:
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write('#pragma once\\n' if path.endswith('.h') else '')
+'''
+
+def get_target_key(root, directory, name):
+    return '{}/{}/{}.gyp:{}#target'.format(root, directory, directory, name)
+
+def write_source(root, directory, source, contents):
+    path = os.path.join(root, directory, source)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(contents)
+
+def get_configurations(options, index):
+    configurations = {}
+    for configuration in options.configurations:
+        configurations[configuration] = {
+            'cflags':       ['-O{}'.format(0 if configuration == 'Debug' else 2)],
+            'cflags_cc':    ['-fno-exceptions'],
+            'defines':      ['{}=1'.format(configuration.upper()),
+                             'GROUP_{}'.format(index % 7)],
+            'include_dirs': ['src', analyse.GENERATED],
+        }
+    return configurations
+
+def synthesize(root, options):
+    '''
+    Return GYP-style target dictionaries, as passed by GYP to
+    'GenerateOutput', for 'options.targets' targets spread over
+    'options.directories' GYP files, and write their sources under 'root'.
+    One in 'options.action_every' targets is a code generator whose outputs
+    are compiled by the next target, and one in 'options.executable_every'
+    targets is an executable.
+    '''
+    rng       = random.Random(options.seed)
+    targets   = OrderedDict()
+    generated = None
+    for index in range(options.targets):
+        directory = 'dir{}'.format(index % options.directories)
+        name      = 't{}'.format(index)
+        key       = get_target_key(root, directory, name)
+        if index < options.directories:
+            write_source(root, directory, '{}.gyp'.format(directory), '{}\n')
+            write_source(root, directory, 'tools/generate.py', GENERATOR)
+
+        candidates   = list(targets)[-options.targets // 4:]
+        dependencies = rng.sample(candidates, min(options.dependencies,
+                                                  len(candidates)))
+
+        target = {
+            'type':                  'static_library',
+            'toolset':               'target',
+            'dependencies':          list(dependencies),
+            'dependencies_original': list(dependencies),
+            'defines':               ['GROUP_{}'.format(index % 7)],
+            'include_dirs':          ['src', analyse.GENERATED],
+            'configurations':        get_configurations(options, index),
+            'default_configuration': 'Release',
+        }
+
+        if options.action_every and index % options.action_every == 0:
+            outputs = ['{}/{}.{}'.format(analyse.GENERATED, name, extension) \
+                       for extension in ('cc', 'h')]
+            generated         = (key, outputs[0])
+            target['type']    = 'none'
+            target['actions'] = [{
+                'action_name': name,
+                'message':     'Generating {}'.format(name),
+                'inputs':      ['tools/generate.py'],
+                'outputs':     outputs,
+                'action':      ['python', 'tools/generate.py'] + outputs,
+            }]
+        else:
+            if options.executable_every and \
+               index % options.executable_every == 0:
+                target['type'] = 'executable'
+
+            # Mixed C and C++ sources, compiled by an object library each.
+            sources = []
+            for number in range(options.sources):
+                extension = 'c' if number % 5 == 4 else 'cc'
+                source    = 'src/{}_{}.{}'.format(name, number, extension)
+                write_source(root, directory, source,
+                             '#include "{}.h"\nint {}_{}() {{ return {}; }}\n'.format(
+                                                    name, name, number, number))
+                sources.append(source)
+            header = 'src/{}.h'.format(name)
+            write_source(root, directory, header, '#pragma once\n')
+            sources.append(header)
+
+            if generated is not None:
+                generator, source = generated
+                sources.append(source)
+                if generator not in target['dependencies']:
+                    target['dependencies'].append(generator)
+                    target['dependencies_original'].append(generator)
+                generated = None
+            if target['type'] == 'executable':
+                write_source(root, directory, 'src/{}_main.cc'.format(name),
+                             'int main() { return 0; }\n')
+                sources.append('src/{}_main.cc'.format(name))
+            target['sources'] = sources
+
+        targets[key] = target
+    return targets
+
+def get_output_counts(root):
+    files, lines, size = 0, 0, 0
+    with open(os.path.join(root, generate.MANIFEST_FILE), 'r') as f:
+        manifest = json.load(f)['files']
+    for path in manifest:
+        with open(os.path.join(root, path), 'rb') as f:
+            contents = f.read()
+        files += 1
+        lines += contents.count(b'\n')
+        size  += len(contents)
+    return files, lines, size
+
+def check_source_counts(platforms, statistics):
+    '''
+    Raise a 'RuntimeError' unless the sources counted by '--stats' are all
+    the sources of each target, of every language.
+    '''
+    for name, platform in platforms.iteritems():
+        expected = sum(len(generate.get_target_sources(target)) \
+                       for target in platform.targets.itervalues())
+        counted  = sum(counts['sources'] for counts in \
+                       statistics.targets[generate.get_cmake_os(name)].itervalues())
+        if counted != expected:
+            raise RuntimeError(
+                  'Counted {} sources instead of {} for {}'.format(counted,
+                                                                  expected,
+                                                                  name))
+
+def get_peak_memory():
+    '''
+    Return the peak memory of this process in kilobytes, or 'None' where the
+    'resource' module is not available (e.g. on Windows).
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # Kilobytes on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+def run(root, options):
+    results = OrderedDict()
+
+    targets = synthesize(root, options)
+
+    start = time.time()
+    targets  = analyse.normalize_target_paths(targets, root)
+    platform = {'targets': targets, 'analysis': analyse.analyze(targets)}
+    store.dump_json({name: platform for name in options.platforms},
+                    os.path.join(root, generate.ANALYSIS_FILE),
+                    cls=analyse.AnalysisEncoder)
+    results['analyse_seconds'] = time.time() - start
+
+    generate_options = generate.parse_args(options.generate_args)
+    current          = os.getcwd()
+    os.chdir(root)
+    try:
+        statistics = stats.Stats()
+        with statistics.phase('load'):
+            platforms = model.load(generate.ANALYSIS_FILE)
+
+        # The same code path as generate.py, timed by its own phases.
+        generate.generate_all(platforms, generate_options, statistics, False)
+
+        phases = statistics.phases
+        results['load_seconds']     = phases['load']
+        results['generate_seconds'] = sum(seconds
+                                          for name, seconds in phases.iteritems()
+                                          if name not in ('load', 'write'))
+        results['write_seconds']    = phases['write']
+
+        if generate_options.stats:
+            check_source_counts(platforms, statistics)
+            statistics.dump(os.path.join(current, generate_options.stats))
+    finally:
+        os.chdir(current)
+
+    peak_memory = get_peak_memory()
+    if peak_memory is not None:
+        results['peak_memory_kb'] = peak_memory
+    results['files'], results['lines'], results['bytes'] = get_output_counts(root)
+
+    cmake = find_executable('cmake')
+    if options.cmake and cmake:
+        build = os.path.join(root, 'build')
+        os.makedirs(build)
+        start = time.time()
+        with open(os.devnull, 'w') as devnull:
+            status = subprocess.call([cmake, '-Wno-dev', root],
+                                     cwd=build,
+                                     stdout=devnull,
+                                     stderr=subprocess.STDOUT)
+        results['cmake_configure_seconds'] = time.time() - start
+        results['cmake_configure_status']  = status
+
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+                     description='Benchmark analyse.py and generate.py on '
+                                 'synthetic GYP targets.')
+    parser.add_argument('--targets', type=int, default=500,
+                        help='number of targets (default: %(default)s)')
+    parser.add_argument('--sources', type=int, default=20,
+                        help='sources per compiled target (default: %(default)s)')
+    parser.add_argument('--directories', type=int, default=20,
+                        help='number of GYP files (default: %(default)s)')
+    parser.add_argument('--dependencies', type=int, default=4,
+                        help='dependencies per target (default: %(default)s)')
+    parser.add_argument('--action-every', type=int, default=10,
+                        help='make every Nth target a code generator, 0 for '
+                             'none (default: %(default)s)')
+    parser.add_argument('--executable-every', type=int, default=25,
+                        help='make every Nth target an executable, 0 for '
+                             'none (default: %(default)s)')
+    parser.add_argument('--platforms', default='linux2',
+                        help='comma-separated platforms; darwin and win32 '
+                             'need the Xcode or MSVS tools that GYP '
+                             'emulates (default: %(default)s)')
+    parser.add_argument('--configurations', default='Debug,Release',
+                        help='comma-separated configurations; generate.py '
+                             'only writes Debug and Release (default: '
+                             '%(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the dependency graph (default: %(default)s)')
+    parser.add_argument('--no-cmake', dest='cmake', action='store_false',
+                        help='do not time a CMake configure of the output')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the temporary directory')
+    parser.add_argument('--json',
+                        help='also write the results to this file')
+    parser.add_argument('generate_args', nargs=argparse.REMAINDER,
+                        help='arguments passed to generate.py, after --')
+
+    options = parser.parse_args()
+    options.platforms      = options.platforms.split(',')
+    options.configurations = options.configurations.split(',')
+    options.generate_args  = [arg for arg in options.generate_args if arg != '--']
+    return options
+
+def main():
+    options = parse_args()
+    root    = os.path.realpath(tempfile.mkdtemp(prefix='ncg-bench-'))
+    try:
+        results = run(root, options)
+    finally:
+        if options.keep:
+            print('Kept {}'.format(root))
+        else:
+            shutil.rmtree(root)
+
+    for name, value in results.iteritems():
+        if isinstance(value, float):
+            value = '{:.3f}'.format(value)
+        print('{:<25} {}'.format(name, value))
+
+    if options.json:
+        store.dump_json(results, options.json, pretty=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
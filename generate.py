@@ -2,21 +2,87 @@ from __future__ import print_function
 
 import os
 import json
+import fnmatch
+import hashlib
+import argparse
+import multiprocessing
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 import gyp.xcode_emulation
 import gyp.msvs_emulation
 
-ANALYSIS_FILE = 'gyp_analysis.json'
+import model
+import watch
+import stats
+import store
+import includes
+
+ANALYSIS_FILE  = 'gyp_analysis.json'
+ANALYSIS_STORE = 'gyp_analysis'
+MANIFEST_FILE = 'ncg_manifest.json'
 
 CONFIGURATIONS = {'Debug', 'Release'}
 KNOWN_TARGET_TYPES = {'shared_library', 'static_library', 'executable', 'none'}
+OBJECT_LIBRARY_TARGET_TYPES = {'shared_library', 'static_library', 'executable'}
 SOURCE_CATEGORIES = {
     'c':  {'.c'},
     'cc': {'.cc', '.cpp', '.cxx'},
 }
 GENERATED = '${CMAKE_BINARY_DIR}/ncg_generated'
+CREATE_LINK_SCRIPT = GENERATED + '/create_link.cmake'
+LINK_POOL    = 'ncg_link'
+COMPILE_POOL = 'ncg_compile'
+PERFORMANCE_PROFILE = '''\
+set(NCG_LINKER "" CACHE STRING
+    "Linker passed to -fuse-ld (default: mold or lld, if supported)")
+if(NOT MSVC)
+    if(NCG_LINKER STREQUAL "")
+        include(CheckCXXSourceCompiles)
+        foreach(linker mold lld)
+            set(CMAKE_REQUIRED_FLAGS -fuse-ld=${linker})
+            check_cxx_source_compiles("int main() { return 0; }" NCG_HAVE_${linker})
+            unset(CMAKE_REQUIRED_FLAGS)
+            if(NCG_HAVE_${linker})
+                set(NCG_LINKER ${linker})
+                break()
+            endif()
+        endforeach()
+    endif()
+    if(NOT NCG_LINKER STREQUAL "")
+        foreach(type EXE SHARED MODULE)
+            string(APPEND CMAKE_${type}_LINKER_FLAGS " -fuse-ld=${NCG_LINKER}")
+        endforeach()
+    endif()
+    if(CMAKE_SYSTEM_NAME STREQUAL Linux)
+        add_compile_options($<$<CONFIG:Debug>:-gsplit-dwarf>)
+    endif()
+endif()
+
+include(CheckIPOSupported)
+check_ipo_supported(RESULT NCG_IPO_SUPPORTED LANGUAGES C CXX)
+if(NCG_IPO_SUPPORTED)
+    set(CMAKE_INTERPROCEDURAL_OPTIMIZATION_RELEASE ON)
+endif()
+
+cmake_host_system_information(RESULT NCG_MEMORY QUERY TOTAL_PHYSICAL_MEMORY)
+math(EXPR NCG_DEFAULT_LINK_JOBS "${NCG_MEMORY} / 8192 + 1")
+math(EXPR NCG_DEFAULT_COMPILE_JOBS "${NCG_MEMORY} / 2048 + 1")
+set(NCG_LINK_JOBS ${NCG_DEFAULT_LINK_JOBS} CACHE STRING
+    "Number of heavyweight targets linked in parallel")
+set(NCG_COMPILE_JOBS ${NCG_DEFAULT_COMPILE_JOBS} CACHE STRING
+    "Number of sources of memory-hungry targets compiled in parallel")
+set_property(GLOBAL APPEND PROPERTY JOB_POOLS
+    ncg_link=${NCG_LINK_JOBS}
+    ncg_compile=${NCG_COMPILE_JOBS}
+)
+'''
+ACTION_CACHE_SCRIPT = 'ncg_action_cache.py'
+ACTION_CACHE_LAUNCHER = ['${NCG_PYTHON}',
+                         '${{CMAKE_SOURCE_DIR}}/{}'.format(ACTION_CACHE_SCRIPT),
+                         '--cache=${NCG_ACTION_CACHE}',
+                         '--build-dir=${CMAKE_BINARY_DIR}']
+UNITY_EXCLUDE_FILE = '{}.unity-exclude'
 
 def get_cmake_os(platform):
     if platform.startswith('linux'):
@@ -40,73 +106,156 @@ class Properties(object):
 
         flags = []
         if self._category == 'c':
-            flags += configuration.get('cflags_c', [])
+            flags += configuration.cflags_c
         elif self._category == 'cc':
-            flags += configuration.get('cflags_cc', [])
+            flags += configuration.cflags_cc
         else:
             raise RuntimeError('Unknown category: ' + self._category)
-        flags += configuration.get('cflags', [])
+        flags += configuration.cflags
 
         return flags
 
     @staticmethod
-    def defines(self, configuration_name, configuration):
-        return configuration.get('defines', [])
+    def defines(configuration_name, configuration):
+        return list(configuration.defines)
 
     @staticmethod
-    def include_dirs(self, configuration_name, configuration):
-        return configuration.get('include_dirs', [])
+    def include_dirs(configuration_name, configuration):
+        return list(configuration.include_dirs)
 
 class EmulatedProperties(object):
     def __init__(self, settings, category):
-        self._settings = settings
-        self._category = category
+        self._settings      = settings
+        self._category      = category
+        self._compile_flags = {}
+        self._defines       = {}
 
     def compile_flags(self, configuration_name, configuration):
         if configuration_name is None:
             return []
 
-        flags = []
-        if self._category == 'c':
-            flags += self._settings.GetCflagsC(configuration_name)
-        elif self._category == 'cc':
-            flags += self._settings.GetCflagsCC(configuration_name)
-        else:
-            raise RuntimeError('Unknown category: ' + self._category)
-        flags += self._settings.GetCflags(configuration_name)
+        if configuration_name not in self._compile_flags:
+            flags = []
+            if self._category == 'c':
+                flags += self._settings.GetCflagsC(configuration_name)
+            elif self._category == 'cc':
+                flags += self._settings.GetCflagsCC(configuration_name)
+            else:
+                raise RuntimeError('Unknown category: ' + self._category)
+            flags += self._settings.GetCflags(configuration_name)
+            self._compile_flags[configuration_name] = flags
 
-        return flags
+        return list(self._compile_flags[configuration_name])
 
     def defines(self, configuration_name, configuration):
-        defines = Properties.defines(configuration_name, configuration)
+        if configuration_name not in self._defines:
+            defines = Properties.defines(configuration_name, configuration)
 
-        if hasattr(self._settings, 'GetComputedDefines'):
-            defines += self._settings.GetComputedDefines(configuration_name)
+            if hasattr(self._settings, 'GetComputedDefines'):
+                defines += self._settings.GetComputedDefines(configuration_name)
+            self._defines[configuration_name] = defines
 
-        return defines
+        return list(self._defines[configuration_name])
 
     def include_dirs(self, configuration_name, configuration):
         return Properties.include_dirs(configuration_name, configuration)
 
+class PrunedProperties(object):
+    '''
+    The properties of an object library with only the include directories
+    that its sources need, in the order given by 'order_include_dirs'.
+    '''
+    def __init__(self, properties, kept, hits, constraints):
+        self._properties  = properties
+        self._kept        = kept
+        self._hits        = hits
+        self._constraints = constraints
+
+    def compile_flags(self, configuration_name, configuration):
+        return self._properties.compile_flags(configuration_name, configuration)
+
+    def defines(self, configuration_name, configuration):
+        return self._properties.defines(configuration_name, configuration)
+
+    def include_dirs(self, configuration_name, configuration):
+        include_dirs = self._properties.include_dirs(configuration_name,
+                                                     configuration)
+        return order_include_dirs([d for d in include_dirs if d in self._kept],
+                                  self._hits,
+                                  self._constraints)
+
+# The emulation settings of each target of the platform being generated and
+# its properties for each category, which memoize the flags computed for each
+# configuration:
+#   (platform, name) -> settings
+#   (platform, name, category) -> EmulatedProperties
+_settings   = {}
+_properties = {}
+
+def get_emulation_settings(platform, target):
+    key = (platform, target.name)
+    if key not in _settings:
+        if platform == 'Darwin':
+            _settings[key] = gyp.xcode_emulation.XcodeSettings(target.spec)
+        else:
+            _settings[key] = gyp.msvs_emulation.MsvsSettings(target.spec, {})
+    return _settings[key]
+
 def get_properties_factory(platform, target, category):
-    if platform == 'Darwin':
-        return EmulatedProperties(gyp.xcode_emulation.XcodeSettings(target),
-                                  category)
-    elif platform == 'Windows':
-        return EmulatedProperties(gyp.msvs_emulation.MsvsSettings(target, {}),
-                                  category)
-    else:
+    if platform not in {'Darwin', 'Windows'}:
         return Properties(category)
 
+    key = (platform, target.name, category)
+    if key not in _properties:
+        _properties[key] = EmulatedProperties(get_emulation_settings(platform,
+                                                                     target),
+                                              category)
+    return _properties[key]
+
+def clear_platform_caches():
+    # The settings hold the spec of each emulated target, which a store
+    # would otherwise only load while that target is generated.
+    _settings.clear()
+    _properties.clear()
+
+def clear_caches():
+    clear_platform_caches()
+    includes.clear()
+
+def get_configuration_expression(configuration_name, property):
+    for character, expression in (('>', '$<ANGLE-R>'),
+                                  (',', '$<COMMA>'),
+                                  (';', '$<SEMICOLON>')):
+        property = property.replace(character, expression)
+    return '$<$<CONFIG:{}>:{}>'.format(configuration_name, property)
+
+def quote_string(value):
+    for character, replacement in (('\\', '\\\\'), ('"', '\\"')):
+        value = value.replace(character, replacement)
+    return '"{}"'.format(value)
+
+def quote_argument(argument):
+    '''
+    Quote 'argument', if needed, so that CMake passes it unchanged as a single
+    argument to a 'VERBATIM' custom command.
+    '''
+    if argument != '' and not any(c in argument for c in ' \t\n"\\;#()'):
+        return argument
+
+    return quote_string(argument.replace(';', '$<SEMICOLON>'))
+
+def quote_arguments(arguments):
+    return ' '.join(quote_argument(argument) for argument in arguments)
+
 class Writer(object):
-    def __init__(self, file):
+    def __init__(self, file, options):
         self._file         = file
+        self._options      = options
         self._interfaces   = set()
         self._indent_level = 0
 
-    def _write(self, *args, **kwargs):
-        indentation = ''.join(' ' for i in range(self._indent_level))
-        print(*args, file=self._file, **kwargs)
+    def _write(self, line):
+        self._file.write(line + '\n')
 
     def _exposure(self, unqualified_name, property_name):
         if property_name in {'add_dependencies'}:
@@ -125,6 +274,14 @@ class Writer(object):
         self._indent_level -= 4
         self._write('endif()')
 
+    def target_start(self, target_name):
+        self._write('if(TARGET {})'.format(target_name))
+        self._indent_level += 4
+
+    def target_end(self):
+        self._indent_level -= 4
+        self._write('endif()\n')
+
     def properties(self, property_name, target_name, properties):
         if len(properties) == 0:
             return
@@ -145,6 +302,12 @@ class Writer(object):
         if len(properties) == 0:
             return
 
+        if self._options.multi_config:
+            properties = [get_configuration_expression(configuration_name, p) \
+                          for property in properties for p in property.split()]
+            self.properties(property_name, target_name, properties)
+            return
+
         self._write('if(CMAKE_BUILD_TYPE STREQUAL "{}")'.format(configuration_name))
         self._write('    {}('.format(property_name))
         self._write('        {}{}'.format(target_name, self._exposure(target_name,
@@ -155,12 +318,80 @@ class Writer(object):
         self._write('    )')
         self._write('endif()\n')
 
-    def custom_command(self, inputs, action, outputs):
+    def config_properties(self,
+                          property_name,
+                          target_name,
+                          general_properties,
+                          specific_properties,
+                          reorderable):
+        flattened_properties = {
+            name: general_properties + properties \
+                        for name, properties in specific_properties.iteritems()
+        }
+
+        if reorderable:
+            common_properties = [set(properties) for properties in flattened_properties.itervalues()]
+            common_properties = reduce(set.intersection, common_properties)
+            self.properties(property_name, target_name, common_properties)
+            for configuration_name, properties in specific_properties.iteritems():
+                properties = set(properties) - common_properties
+                self.configuration_properties(property_name,
+                                              target_name,
+                                              configuration_name,
+                                              properties)
+        else:
+            all_properties = flattened_properties.itervalues()
+            first_properties = next(all_properties)
+            if all([first_properties == properties for properties in all_properties]):
+                self.properties(property_name, target_name, first_properties)
+            else:
+                self.properties(property_name, target_name, general_properties)
+                for configuration_name, properties in sorted(specific_properties.iteritems()):
+                    self.configuration_properties(property_name,
+                                                  target_name,
+                                                  configuration_name,
+                                                  properties)
+
+    def custom_action(self, action):
+        command = action.action
+
+        # The implicit inputs of actions with a depfile are not part of the
+        # cache key, so these actions are never cached.
+        if self._options.action_cache and action.depfile is None:
+            command = ACTION_CACHE_LAUNCHER + ['--inputs'] + list(action.inputs) + \
+                                              ['--outputs'] + list(action.outputs) + \
+                                              ['--'] + list(command)
+
+        depfile = action.depfile
+        if depfile is not None and not depfile.startswith('$'):
+            depfile = '${{CMAKE_CURRENT_SOURCE_DIR}}/{}'.format(depfile)
+
+        self.custom_command(action.inputs,
+                            command,
+                            action.outputs,
+                            byproducts=action.byproducts,
+                            depfile=depfile,
+                            comment=action.message)
+
+    def custom_command(self,
+                       inputs,
+                       action,
+                       outputs,
+                       byproducts=(),
+                       depfile=None,
+                       comment=None):
         self._write('add_custom_command(')
-        self._write('    OUTPUT {}'.format(' '.join(outputs)))
-        self._write('    DEPENDS {}'.format(' '.join(inputs)))
-        self._write('    COMMAND {}'.format(' '.join(action)))
+        self._write('    OUTPUT {}'.format(quote_arguments(outputs)))
+        if len(byproducts):
+            self._write('    BYPRODUCTS {}'.format(quote_arguments(byproducts)))
+        self._write('    DEPENDS {}'.format(quote_arguments(inputs)))
+        if depfile is not None:
+            self._write('    DEPFILE {}'.format(quote_argument(depfile)))
+        self._write('    COMMAND {}'.format(quote_arguments(action)))
         self._write('    WORKING_DIRECTORY ${CMAKE_CURRENT_SOURCE_DIR}')
+        if comment is not None:
+            self._write('    COMMENT {}'.format(quote_string(comment)))
+        self._write('    VERBATIM')
         self._write(')\n')
 
     def library_with_actions(self, unqualified_name, sources):
@@ -193,19 +424,68 @@ class Writer(object):
         self._write('add_library(')
         self._write('    {} INTERFACE'.format(unqualified_name))
         self._write(')\n')
+        self.mark_interface(unqualified_name)
+
+    def mark_interface(self, unqualified_name):
         self._interfaces.add(unqualified_name)
 
-    def target(self, target_type, lib_type, unqualified_name, source_categories):
+    def is_interface(self, unqualified_name):
+        return unqualified_name in self._interfaces
+
+    def target(self, target_type, lib_type, unqualified_name, object_libraries):
         self._write('add_{}('.format(target_type))
         if lib_type:
             self._write('    {} {}'.format(unqualified_name, lib_type))
         else:
             self._write('    {}'.format(unqualified_name))
-        for category in source_categories:
-            self._write('    $<TARGET_OBJECTS:{}-{}>'.format(unqualified_name,
-                category))
+        for object_library in object_libraries:
+            self._write('    $<TARGET_OBJECTS:{}>'.format(object_library))
+        self._write(')\n')
+
+    def precompile_headers(self, target_name, headers, skipped_sources):
+        self.properties('target_precompile_headers', target_name, headers)
+
+        if len(skipped_sources) == 0:
+            return
+
+        self._write('set_source_files_properties(')
+        for source in skipped_sources:
+            self._write('    {}'.format(source))
+        self._write('    PROPERTIES SKIP_PRECOMPILE_HEADERS ON')
+        self._write(')\n')
+
+    def job_pool(self, target_name, property_name, pool):
+        self._write('set_property(')
+        self._write('    TARGET {}'.format(target_name))
+        self._write('    PROPERTY {} {}'.format(property_name, pool))
+        self._write(')\n')
+
+    def unity_build(self, target_name, batch_size, excluded_sources):
+        self._write('set_target_properties(')
+        self._write('    {}'.format(target_name))
+        self._write('    PROPERTIES')
+        self._write('    UNITY_BUILD ON')
+        self._write('    UNITY_BUILD_BATCH_SIZE {}'.format(batch_size))
+        self._write(')\n')
+
+        if len(excluded_sources) == 0:
+            return
+
+        self._write('set_source_files_properties(')
+        for source in excluded_sources:
+            self._write('    {}'.format(source))
+        self._write('    PROPERTIES SKIP_UNITY_BUILD_INCLUSION ON')
         self._write(')\n')
 
+    def object_depends(self, object_depends):
+        for source, dependencies in sorted(object_depends.iteritems()):
+            self._write('set_property(')
+            self._write('    SOURCE {}'.format(source))
+            self._write('    APPEND PROPERTY OBJECT_DEPENDS')
+            for dependency in dependencies:
+                self._write('    {}'.format(dependency))
+            self._write(')\n')
+
     def generated_sources(self, sources):
         self._write('set_source_files_properties(')
         for source in sources:
@@ -213,17 +493,407 @@ class Writer(object):
         self._write('    PROPERTIES GENERATED TRUE')
         self._write(')\n')
 
-    def copies(self, destination, files):
-        self._write('file(')
-        self._write('    COPY')
-        for file in files:
-            self._write('    {}'.format(file))
-        self._write('    DESTINATION {}'.format(destination))
-        self._write(')\n')
+    def copy(self, source, destination):
+        if self._options.copy_mode == 'copy':
+            action = ['${CMAKE_COMMAND}', '-E', 'copy_if_different',
+                      source, destination]
+        else:
+            action = ['${CMAKE_COMMAND}',
+                      '-DSOURCE={}'.format(get_cmake_path('CMAKE_CURRENT_SOURCE_DIR',
+                                                          source)),
+                      '-DDESTINATION={}'.format(destination)]
+            if self._options.copy_mode == 'symlink':
+                action.append('-DMODE=SYMBOLIC')
+            action += ['-P', CREATE_LINK_SCRIPT]
+
+        self.custom_command([source], action, [destination])
+        return destination
+
+    def copy_directory(self, source, destination, path):
+        files = get_directory_files(os.path.join(path, source))
+        if files is None:
+            # A directory that does not exist yet, e.g. one generated by an
+            # action, is copied whole.
+            action = ['${CMAKE_COMMAND}', '-E', 'copy_directory',
+                      source, destination]
+            self.custom_command([source], action, [destination])
+            return [destination]
+
+        # One rule per file, so that editing a file only copies that file.
+        return [self.copy('{}/{}'.format(source, file),
+                          '{}/{}'.format(destination, file)) for file in files]
+
+    def copies(self, target_name, path, copies):
+        outputs = []
+        for copy in copies:
+            # Like 'file(COPY)', relative destinations are in the build tree.
+            destination = get_cmake_path('CMAKE_CURRENT_BINARY_DIR',
+                                         copy.destination)
+
+            for file in copy.files:
+                if file.endswith('/'):
+                    directory = file.rstrip('/')
+                    outputs  += self.copy_directory(
+                                      directory,
+                                      '{}/{}'.format(destination,
+                                                     os.path.basename(directory)),
+                                      path)
+                else:
+                    outputs.append(self.copy(file,
+                                             '{}/{}'.format(destination,
+                                                            os.path.basename(file))))
+        self.custom_target(target_name, remove_duplicates(outputs), [])
+
+class OutputFile(object):
+    def __init__(self):
+        self._chunks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def truncate(self):
+        self._chunks = []
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
+class OutputTree(object):
+    '''
+    Collect the contents of every generated file in memory so that each file
+    is written once, after all platforms have been generated.  In incremental
+    mode, files whose contents did not change are left untouched (preserving
+    their mtime) and files produced by the previous run that are no longer
+    generated are removed.
+    '''
+    def __init__(self):
+        self._files = {}
+
+    def open(self, path, mode='a'):
+        output = self._files.setdefault(os.path.normpath(path), OutputFile())
+        if mode == 'w':
+            output.truncate()
+        return output
+
+    def commit(self, incremental):
+        previous = {}
+        if os.path.isfile(MANIFEST_FILE):
+            with open(MANIFEST_FILE, 'r') as f:
+                previous = json.load(f)['files']
+
+        manifest = {}
+        written  = 0
+        for path, output in sorted(self._files.iteritems()):
+            contents       = output.getvalue()
+            digest         = hashlib.sha1(contents).hexdigest()
+            manifest[path] = digest
+
+            if incremental and get_file_digest(path) == digest:
+                continue
+
+            # Replace each file atomically, so that a build started while
+            # generating (or an interrupted run) never sees a partial file.
+            temporary = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temporary, 'w') as f:
+                f.write(contents)
+            store.replace_file(temporary, path)
+            written += 1
+
+        removed = 0
+        if incremental:
+            for path in sorted(set(previous) - set(manifest)):
+                if os.path.isfile(path):
+                    os.remove(path)
+                    removed += 1
+
+        store.dump_json({'files': manifest}, MANIFEST_FILE, pretty=True)
+
+        return written, removed
+
+def get_file_digest(path):
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, 'r') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class HoistingWriter(Writer):
+    '''
+    A 'Writer' that records the per-configuration properties and the object
+    library sources of each target instead of writing them, so that the
+    parts common to all platforms and configurations can be written once by
+    'generate_hoisted_properties'.
+    '''
+    def __init__(self, file, options):
+        super(HoistingWriter, self).__init__(file, options)
+        self.hoisted = []
+
+    def config_properties(self,
+                          property_name,
+                          target_name,
+                          general_properties,
+                          specific_properties,
+                          reorderable):
+        self.hoisted.append((property_name,
+                             target_name,
+                             self.is_interface(target_name),
+                             general_properties,
+                             specific_properties,
+                             reorderable))
+
+    def object_library(self, unqualified_name, category, sources):
+        super(HoistingWriter, self).object_library(unqualified_name,
+                                                   category,
+                                                   [])
+        self.config_properties('target_sources',
+                               '{}-{}'.format(unqualified_name, category),
+                               sorted(sources),
+                               {},
+                               True)
+
+def get_flattened_properties(general_properties, specific_properties):
+    if len(specific_properties) == 0:
+        return {None: general_properties}
+
+    return { name: general_properties + properties \
+                        for name, properties in specific_properties.iteritems() }
+
+def get_common_properties(all_properties, reorderable):
+    if reorderable:
+        common_properties = reduce(set.intersection,
+                                   [set(properties) for properties in all_properties])
+        return remove_duplicates([p for p in all_properties[0] \
+                                                      if p in common_properties])
+
+    common_properties = all_properties[0]
+    for properties in all_properties[1:]:
+        length = 0
+        while length < min(len(common_properties), len(properties)) and \
+                              common_properties[length] == properties[length]:
+            length += 1
+        common_properties = common_properties[:length]
+    return common_properties
+
+def remove_common_properties(properties, common_properties, reorderable):
+    if reorderable:
+        common_properties = set(common_properties)
+        return remove_duplicates([p for p in properties \
+                                                  if p not in common_properties])
+
+    return properties[len(common_properties):]
+
+def remove_duplicates(properties):
+    seen   = set()
+    result = []
+    for property in properties:
+        if property not in seen:
+            seen.add(property)
+            result.append(property)
+    return result
+
+def generate_hoisted_properties(writer,
+                                property_name,
+                                target_name,
+                                records,
+                                all_platforms):
+    '''
+    Write the properties recorded by 'HoistingWriter' for 'target_name' on
+    each platform: first the properties common to every platform and
+    configuration, then those common to each configuration on every platform,
+    then, per platform, those common to its configurations, and finally the
+    remaining properties of each configuration.  Ordered properties are only
+    hoisted as a common prefix, so their resulting order is unchanged.
+    '''
+    reorderable = next(records.itervalues())[3]
+    remaining   = {
+        platform: get_flattened_properties(general, specific) \
+                for platform, (_, general, specific, _) in records.iteritems()
+    }
+
+    common_properties = get_common_properties(
+                    [properties for platform in sorted(remaining) \
+                     for _, properties in sorted(remaining[platform].iteritems())],
+                    reorderable)
+    for properties in remaining.itervalues():
+        for name in properties:
+            properties[name] = remove_common_properties(properties[name],
+                                                        common_properties,
+                                                        reorderable)
+
+    configuration_names = reduce(set.intersection,
+                                 [set(properties) for properties in remaining.itervalues()])
+    configuration_names.discard(None)
+
+    configuration_properties = {}
+    for name in configuration_names:
+        configuration_properties[name] = get_common_properties(
+                        [remaining[platform][name] for platform in sorted(remaining)],
+                        reorderable)
+        for properties in remaining.itervalues():
+            properties[name] = remove_common_properties(properties[name],
+                                                        configuration_properties[name],
+                                                        reorderable)
+
+    guarded = set(records) != set(all_platforms)
+    if guarded:
+        writer.target_start(target_name)
+    writer.properties(property_name, target_name, common_properties)
+    for name, properties in sorted(configuration_properties.iteritems()):
+        writer.configuration_properties(property_name,
+                                        target_name,
+                                        name,
+                                        properties)
+    if guarded:
+        writer.target_end()
+
+    for platform in sorted(remaining):
+        platform_properties = get_common_properties(
+                        [properties for _, properties in sorted(remaining[platform].iteritems())],
+                        reorderable)
+        specific_properties = {
+            name: remove_common_properties(properties,
+                                           platform_properties,
+                                           reorderable) \
+                       for name, properties in remaining[platform].iteritems() \
+                       if name is not None
+        }
+
+        if len(platform_properties) == 0 and \
+           all(len(properties) == 0 for properties in specific_properties.itervalues()):
+            continue
+
+        writer.platform_start(platform)
+        writer.properties(property_name, target_name, platform_properties)
+        for name, properties in sorted(specific_properties.iteritems()):
+            writer.configuration_properties(property_name,
+                                            target_name,
+                                            name,
+                                            properties)
+        writer.platform_end()
+
+def generate_platform_properties(f, property_name, target_name, records, options):
+    '''
+    Write the properties recorded for 'target_name' in a block per platform,
+    with the exposure of the target on that platform.
+    '''
+    for platform, record in sorted(records.iteritems()):
+        writer = Writer(f, options)
+        if record[0]:
+            writer.mark_interface(target_name)
+        writer.platform_start(platform)
+        generate_hoisted_properties(writer,
+                                    property_name,
+                                    target_name,
+                                    {platform: record},
+                                    {platform})
+        writer.platform_end()
+
+def generate_all_hoisted_properties(outputs, hoisted, all_platforms, options):
+    for cmake, all_records in sorted(hoisted.iteritems()):
+        with outputs.open(cmake) as f:
+            writer = Writer(f, options)
+            for (property_name, target_name), records in all_records.iteritems():
+                exposures = set(interface for interface, _, _, _ in records.itervalues())
+                if len(exposures) > 1:
+                    # E.g. an INTERFACE library on one platform and compiled
+                    # on another: each platform needs its own keyword.
+                    generate_platform_properties(f,
+                                                 property_name,
+                                                 target_name,
+                                                 records,
+                                                 options)
+                    continue
+
+                if exposures.pop():
+                    writer.mark_interface(target_name)
+                generate_hoisted_properties(writer,
+                                            property_name,
+                                            target_name,
+                                            records,
+                                            all_platforms)
 
 def unqualify_name(gyp_target):
     return gyp_target.split(':')[1].split('#')[0]
 
+def get_target_path(gyp_target):
+    return os.path.dirname(gyp_target.split(':')[0])
+
+def get_cmake_path(variable, path):
+    '''
+    Return 'path' relative to the directory in the CMake 'variable', unless
+    it is absolute or starts with a CMake variable.
+    '''
+    if os.path.isabs(path) or path.startswith('$'):
+        return path
+    return '${{{}}}/{}'.format(variable, path)
+
+def get_directory_files(directory):
+    '''
+    Return the paths, relative to 'directory', of the files under it, or
+    'None' if it is not a directory (yet).
+    '''
+    if '$' in directory or not os.path.isdir(directory):
+        return None
+
+    files = []
+    for root, directories, names in os.walk(directory):
+        directories.sort()
+        for name in sorted(names):
+            files.append(os.path.relpath(os.path.join(root, name),
+                                         directory).replace(os.sep, '/'))
+    return files
+
+def is_header(source):
+    return os.path.splitext(source)[1] == '.h'
+
+def get_target_sources(target):
+    sources = set(target.sources)
+    for action in target.actions:
+        sources |= set(action.outputs)
+    return sources
+
+def get_dependencies(target, analysis):
+    dependencies  = []
+    dependencies += target.dependencies
+    dependencies += target.dependencies_original
+
+    return split_dependencies(dependencies, analysis)
+
+def split_dependencies(dependencies, analysis):
+    link_dependencies    = []
+    nonlink_dependencies = []
+    all_dependencies     = []
+    for d in dependencies:
+        unqualified_depedency = unqualify_name(d)
+
+        all_dependencies.append(unqualified_depedency)
+
+        if is_link_dependency(d, analysis):
+            link_dependencies.append(unqualified_depedency)
+        else:
+            nonlink_dependencies.append(unqualified_depedency)
+
+    return link_dependencies, nonlink_dependencies, all_dependencies
+
+def is_link_dependency(dependency, analysis):
+    return dependency not in analysis.generated_libraries and \
+           dependency not in analysis.executables
+
+def get_planned_dependencies(name, target, analysis, plan):
+    if name in plan.dependencies:
+        return tuple(list(d) for d in plan.dependencies[name])
+    return get_dependencies(target, analysis)
+
+def has_object_libraries(name, target, analysis):
+    return target.type in OBJECT_LIBRARY_TARGET_TYPES      and \
+           name not in analysis.generated_libraries        and \
+           name not in analysis.interface_libraries
+
 def get_sources_properties_by_category(platform, target, sources):
     result = defaultdict(lambda: [set(), None])
 
@@ -250,201 +920,1000 @@ def generate_config_properties(writer,
                                get_properties,
                                cmake_name,
                                reorderable=False):
-    general_properties  = list(get_properties(None, target))
+    general_properties  = list(get_properties(None, target.settings))
     specific_properties = {
-        name: list(get_properties(name, target['configurations'][name])) \
+        name: list(get_properties(name, target.configurations[name])) \
                                            for name in CONFIGURATIONS    \
-                                           if name in target['configurations']
+                                           if name in target.configurations
     }
 
-    flattened_properties = {
-        name: general_properties + properties \
-                        for name, properties in specific_properties.iteritems()
-    }
+    writer.config_properties(cmake_name,
+                             target_name,
+                             general_properties,
+                             specific_properties,
+                             reorderable)
 
-    if reorderable:
-        common_properties = [set(properties) for properties in flattened_properties.itervalues()]
-        common_properties = reduce(set.intersection, common_properties)
-        writer.properties(cmake_name, target_name, common_properties)
-        for configuration_name, properties in specific_properties.iteritems():
-            properties = set(properties) - common_properties
-            writer.configuration_properties(cmake_name,
-                                            target_name,
-                                            configuration_name,
-                                            properties)
+def generate_compile_properties(writer, target_name, target, properties):
+    generate_config_properties(writer,
+                               target_name,
+                               target,
+                               properties.compile_flags,
+                               'target_compile_options')
+    generate_config_properties(writer,
+                               target_name,
+                               target,
+                               properties.include_dirs,
+                               'target_include_directories')
+    generate_config_properties(writer,
+                               target_name,
+                               target,
+                               properties.defines,
+                               'target_compile_definitions',
+                               True)
+
+def generate_object_library(writer,
+                            unqualified_name,
+                            category,
+                            sources,
+                            target,
+                            properties,
+                            analysis,
+                            dependencies,
+                            consumers,
+                            plan,
+                            options):
+    object_library = '{}-{}'.format(unqualified_name, category)
+    writer.object_library(unqualified_name, category, sources)
+    object_depends = {}
+    if options.fine_grained_deps:
+        dependencies, object_depends = get_fine_grained_dependencies(
+                                                                sources,
+                                                                target,
+                                                                properties,
+                                                                analysis,
+                                                                dependencies,
+                                                                plan)
+        writer.object_depends(object_depends)
+    profile = plan.profiles.get((target.name, category))
+    headers = []
+    if options.pch:
+        headers, skipped_sources = get_precompile_headers(sources,
+                                                          target,
+                                                          properties,
+                                                          analysis,
+                                                          options.pch_threshold)
+        if len(headers):
+            writer.precompile_headers(object_library, headers, skipped_sources)
+    if options.unity:
+        excluded_sources = get_unity_excluded_sources(sources,
+                                                      analysis,
+                                                      consumers)
+
+        # Unity sources do not inherit the 'OBJECT_DEPENDS' of the sources
+        # they combine.
+        excluded_sources = sorted(set(excluded_sources) | set(object_depends))
+        unity_sources = [s for s in sources if not is_header(s)]
+        if len(unity_sources) - len(excluded_sources) > 1:
+            writer.unity_build(object_library,
+                               options.unity_batch_size,
+                               excluded_sources)
+    if profile is not None:
+        writer.properties('target_link_libraries', object_library, [profile])
     else:
-        all_properties = flattened_properties.itervalues()
-        first_properties = next(all_properties)
-        if all([first_properties == properties for properties in all_properties]):
-            writer.properties(cmake_name, target_name, first_properties)
-        else:
-            writer.properties(cmake_name, target_name, general_properties)
-            for configuration_name, properties in sorted(specific_properties.iteritems()):
-                writer.configuration_properties(cmake_name,
-                                                target_name,
-                                                configuration_name,
-                                                properties)
-
-def generate_target(platform, name, target, analysis, all_targets):
-    unqualified_name = unqualify_name(name)
-    path             = os.path.dirname(name.split(':')[0])
-
-    lists = os.path.join(path, 'CMakeLists.txt')
-    cmake = os.path.join(path, '{}.cmake'.format(unqualified_name))
-
-    if unqualified_name not in all_targets:
-        all_targets.add(unqualified_name)
-        with open(lists, 'a') as f:
-            print('include({})'.format(os.path.basename(cmake)), file=f)
-
-    with open(cmake, 'a') as f:
-        writer = Writer(f)
-        writer.platform_start(platform)
-        sources = set(target['sources'])
-        for action in target.get('actions', []):
-            writer.custom_command(action['inputs'],
-                                  action['action'],
-                                  action['outputs'])
-            sources |= set(action['outputs'])
-
-        dependencies  = []
-        dependencies += target.get('dependencies', [])
-        dependencies += target.get('dependencies_original', [])
-
-        link_dependencies    = []
-        nonlink_dependencies = []
-        all_dependencies     = []
-        for d in dependencies:
-            unqualified_depedency = unqualify_name(d)
-
-            all_dependencies.append(unqualified_depedency)
-
-            if d in analysis['generated_libraries'] or \
-                                                  d in analysis['executables']:
-                nonlink_dependencies.append(unqualified_depedency)
+        if options.prune_includes:
+            properties = get_pruned_properties(sources,
+                                               target,
+                                               properties,
+                                               analysis,
+                                               [h.strip('<>') for h in headers])
+        generate_compile_properties(writer, object_library, target, properties)
+
+    if options.perf_profile and any(in_pool(name, options.compile_pool) \
+                                    for name in consumers):
+        writer.job_pool(object_library, 'JOB_POOL_COMPILE', COMPILE_POOL)
+
+    generated_sources = [s for s in sources if s in analysis.all_generated_sources]
+    if len(generated_sources) > 0:
+        writer.generated_sources(generated_sources)
+
+    writer.properties('add_dependencies', object_library, dependencies)
+
+def in_pool(name, patterns):
+    return any(fnmatch.fnmatch(unqualify_name(name), pattern) \
+               for pattern in patterns)
+
+def get_unity_exclusions(name):
+    path = os.path.join(get_target_path(name),
+                        UNITY_EXCLUDE_FILE.format(unqualify_name(name)))
+    if not os.path.isfile(path):
+        return []
+
+    with open(path, 'r') as f:
+        lines = [line.split('#')[0].strip() for line in f]
+    return [line for line in lines if line]
+
+def get_unity_excluded_sources(sources, analysis, consumers):
+    '''
+    Return the sources that must not be combined into unity sources: sources
+    generated by actions, and sources matching a pattern listed in the
+    '<target>.unity-exclude' file of any target using the object library.
+    '''
+    patterns = [pattern for name in consumers \
+                        for pattern in get_unity_exclusions(name)]
+
+    excluded_sources = []
+    for source in sorted(sources):
+        if is_header(source):
+            continue
+        if source in analysis.all_generated_sources or \
+                   any(fnmatch.fnmatch(source, pattern) for pattern in patterns):
+            excluded_sources.append(source)
+    return excluded_sources
+
+def get_include_dirs(target, properties):
+    include_dirs = list(properties.include_dirs(None, target.settings))
+    for name in sorted(CONFIGURATIONS):
+        if name in target.configurations:
+            include_dirs += properties.include_dirs(name,
+                                                    target.configurations[name])
+    return remove_duplicates(include_dirs)
+
+def is_scannable_include_dir(include_dir):
+    # Directories named by CMake variables (e.g. of generated headers) do not
+    # exist yet.
+    return '$' not in include_dir
+
+def get_pruned_properties(sources, target, properties, analysis, headers):
+    '''
+    Return 'properties' with only the include directories that resolve an
+    include of 'sources', or of the headers they reach, or one of the
+    precompiled 'headers' (which are included with '<>'), in any
+    configuration, or 'properties' itself if not all of these files can be
+    scanned.  Directories that cannot be scanned are kept, and no directory
+    is moved past one of them.
+    '''
+    path = get_target_path(target.name)
+    if any(source in analysis.all_generated_sources for source in sources):
+        return properties
+
+    configurations = [name for name in sorted(CONFIGURATIONS) \
+                           if name in target.configurations]
+    if len(configurations) == 0:
+        return properties
+
+    paths       = [os.path.join(path, source) for source in sorted(sources)]
+    general     = list(properties.include_dirs(None, target.settings))
+    kept        = set()
+    hits        = defaultdict(int)
+    constraints = set()
+    for name in configurations:
+        include_dirs = remove_duplicates(general + list(properties.include_dirs(
+                                                    name,
+                                                    target.configurations[name])))
+        scanned = OrderedDict()
+        for include_dir in include_dirs:
+            if is_scannable_include_dir(include_dir):
+                scanned.setdefault(os.path.normpath(os.path.join(path, include_dir)),
+                                   include_dir)
+            else:
+                kept.add(include_dir)
+                for later in include_dirs[include_dirs.index(include_dir) + 1:]:
+                    constraints.add((include_dir, later))
+
+        result = includes.get_include_dir_hits(paths,
+                                               list(scanned),
+                                               analysis.generated_suffixes)
+        if result is None:
+            return properties
+
+        for include_dir, count in result[0].iteritems():
+            kept.add(scanned[include_dir])
+            hits[scanned[include_dir]] += count
+        for before, after in result[1]:
+            constraints.add((scanned[before], scanned[after]))
+
+        for header in headers:
+            candidates = [include_dir for include_dir in scanned \
+                          if includes.is_file(os.path.normpath(
+                                                os.path.join(include_dir, header)))]
+            if len(candidates):
+                kept.add(scanned[candidates[0]])
+                hits[scanned[candidates[0]]] += 1
+                for candidate in candidates[1:]:
+                    constraints.add((scanned[candidates[0]], scanned[candidate]))
+
+    return PrunedProperties(properties, kept, hits, constraints)
+
+def order_include_dirs(include_dirs, hits, constraints):
+    '''
+    Return 'include_dirs' ordered by decreasing 'hits' such that each pair
+    '(a, b)' in 'constraints' stays in that order, or in their original order
+    if the constraints contradict each other.
+    '''
+    position  = {include_dir: i for i, include_dir in enumerate(include_dirs)}
+    after     = defaultdict(set)
+    remaining = defaultdict(int)
+    for before, include_dir in constraints:
+        if before in position and include_dir in position and \
+           include_dir not in after[before]:
+            after[before].add(include_dir)
+            remaining[include_dir] += 1
+
+    key    = lambda include_dir: (-hits.get(include_dir, 0), position[include_dir])
+    ready  = [d for d in include_dirs if remaining[d] == 0]
+    result = []
+    while len(ready):
+        ready.sort(key=key, reverse=True)
+        include_dir = ready.pop()
+        result.append(include_dir)
+        for later in after[include_dir]:
+            remaining[later] -= 1
+            if remaining[later] == 0:
+                ready.append(later)
+
+    if len(result) != len(include_dirs):
+        return list(include_dirs)
+    return result
+
+def get_precompile_headers(sources, target, properties, analysis, threshold):
+    '''
+    Return the headers to precompile for an object library, and the sources
+    that must not use them.  These are the longest sequence of headers that
+    at least 'threshold' of the sources include at their start, in that
+    order.  The start of a source ends at a generated header or a header
+    that would not be the same file when included from the precompiled
+    header.  Sources that do not start with exactly these headers do not
+    use the precompiled header.
+    '''
+    path         = get_target_path(target.name)
+    include_dirs = [os.path.join(path, include_dir) \
+                    for include_dir in get_include_dirs(target, properties) \
+                    if '$' not in include_dir]
+
+    compiled_sources = sorted(s for s in sources if not is_header(s))
+    prefixes = {}
+    counts   = defaultdict(int)
+    for source in compiled_sources:
+        if source in analysis.all_generated_sources:
+            continue
+
+        directory = os.path.dirname(os.path.join(path, source))
+        prefix    = includes.get_include_prefix(os.path.join(path, source))
+        if prefix is None:
+            continue
+
+        leading = []
+        for kind, header in prefix:
+            if analysis.is_generated(header):
+                break
+            if includes.resolve(header, kind, directory, include_dirs) != \
+                         includes.resolve(header, '<', directory, include_dirs):
+                break
+            if header not in leading:
+                leading.append(header)
+                counts[tuple(leading)] += 1
+        prefixes[source] = leading
+
+    minimum  = max(2, threshold * len(compiled_sources))
+    frequent = [headers for headers, count in counts.iteritems() if count >= minimum]
+    if len(frequent) == 0:
+        return [], []
+
+    headers = list(max(frequent, key=lambda headers: (len(headers),
+                                                      counts[headers],
+                                                      headers)))
+    skipped_sources = [source for source in compiled_sources \
+                              if prefixes.get(source, [])[:len(headers)] != headers]
+    return ['<{}>'.format(header) for header in headers], skipped_sources
+
+def get_fine_grained_dependencies(sources,
+                                  target,
+                                  properties,
+                                  analysis,
+                                  dependencies,
+                                  plan):
+    '''
+    Return the subset of 'dependencies' that an object library compiling
+    'sources' of 'target' must wait for, and the generated headers that each
+    of these sources includes.  Only the producers of generated sources that
+    are compiled (and, for targets with actions of their own, everything the
+    actions may need) remain as dependencies of the whole library; sources
+    that cannot be scanned depend on every header generated by the targets
+    'target' depends on.
+    '''
+    path         = get_target_path(target.name)
+    include_dirs = [os.path.join(path, include_dir) \
+                    for include_dir in get_include_dirs(target, properties) \
+                    if '$' not in include_dir]
+
+    # The custom commands of the target are run as part of this library.
+    needed = set()
+    if len(target.actions):
+        needed.update(dependencies)
+
+    fallback = sorted({output \
+                       for dependency in target.dependencies + target.dependencies_original \
+                       if dependency in analysis.generated_libraries \
+                       for output in plan.generated_outputs.get(dependency, []) \
+                       if is_header(output)})
+
+    object_depends = {}
+    for source in sorted(sources):
+        if is_header(source):
+            continue
+
+        producer = plan.producers.get(source)
+        if producer is not None and producer != target.name:
+            if producer in analysis.interface_libraries:
+                needed.add('{}-{}'.format(unqualify_name(producer), 'actions'))
             else:
-                link_dependencies.append(unqualified_depedency)
-
-        target_type = None
-        library_type = None
-        if target['type'] == 'static_library':
-            target_type = 'library'
-            library_type = 'STATIC'
-        elif target['type'] == 'shared_library':
-            target_type = 'library'
-            library_type = 'SHARED'
-        elif target['type'] == 'executable':
-            target_type = 'executable'
-
-        if name in analysis['generated_libraries']:
-            writer.custom_target(unqualified_name, sources, [])
-        elif name in analysis['interface_libraries']:
-            if len(sources) > 0:
-                action_target = '{}-{}'.format(unqualified_name, 'actions')
-                writer.custom_target(action_target, sources, all_dependencies)
-                nonlink_dependencies.append(action_target)
-
-            # TBD: do we need to export 'c' flags also?
-            properties = get_properties_factory(platform, target, 'cc')
-
-            writer.interface_library(unqualified_name)
-            generate_config_properties(writer,
-                                       unqualified_name,
-                                       target,
-                                       properties.compile_flags,
-                                       'target_compile_options')
-            generate_config_properties(writer,
-                                       unqualified_name,
-                                       target,
-                                       properties.include_dirs,
-                                       'target_include_directories')
-            generate_config_properties(writer,
-                                       unqualified_name,
-                                       target,
-                                       properties.defines,
-                                       'target_compile_definitions',
-                                       True)
-            generate_config_properties(writer,
-                                       unqualified_name,
-                                       target,
-                                       lambda _, target: link_dependencies,
-                                       'target_link_libraries')
-
-            writer.properties('add_dependencies', unqualified_name, nonlink_dependencies)
-        elif target_type:
-            sources_properties_by_category = get_sources_properties_by_category(platform, target, sources)
-            for category, sources_properties in sources_properties_by_category.iteritems():
-                sources, properties = sources_properties
-                if len(sources) == 0:
+                needed.add(unqualify_name(producer))
+
+        headers = None
+        if source not in analysis.all_generated_sources:
+            headers = includes.get_generated_headers(os.path.join(path, source),
+                                                     include_dirs,
+                                                     analysis.generated_suffixes)
+        if headers is None:
+            headers = fallback
+        if len(headers):
+            object_depends[source] = headers
+
+    dependencies = [dependency for dependency in dependencies \
+                               if dependency in needed]
+    return dependencies + sorted(needed - set(dependencies)), object_depends
+
+class Plan(object):
+    '''
+    The results of passes over all the targets of a platform, used when
+    generating each of its targets.
+    '''
+    def __init__(self):
+        # Object libraries shared between several targets, by the name of the
+        # target that defines them:
+        #   name -> [(shared name, category, sources, dependencies, consumers)]
+        self.shared_libraries = {}
+
+        # The shared object libraries used by each target:
+        #   name -> {category: [(shared name, sources)]}
+        self.shared_objects   = {}
+
+        # The outputs of the actions of each target, and the target whose
+        # action produces each output:
+        #   name -> [output]
+        #   output -> name
+        self.generated_outputs = {}
+        self.producers         = {}
+
+        # The dependencies of each target, without duplicates and redundant
+        # link dependencies, split as by 'get_dependencies':
+        #   name -> (link, nonlink, all)
+        self.dependencies      = {}
+
+        # INTERFACE libraries holding the compile properties shared by the
+        # object libraries of several targets, by the name of the target that
+        # defines them, and the one used by each object library:
+        #   name -> [(profile name, category)]
+        #   (name, category) -> profile name
+        self.profile_owners    = {}
+        self.profiles          = {}
+
+def get_properties_signature(target, get_properties, reorderable):
+    normalize = frozenset if reorderable else tuple
+
+    general  = normalize(get_properties(None, target.settings))
+    specific = tuple((name, normalize(get_properties(name, target.configurations[name]))) \
+                            for name in sorted(CONFIGURATIONS)                        \
+                            if name in target.configurations)
+    return general, specific
+
+def get_object_library_signature(target, properties):
+    return (get_properties_signature(target, properties.compile_flags, False),
+            get_properties_signature(target, properties.include_dirs, False),
+            get_properties_signature(target, properties.defines, True))
+
+def plan_profiles(plan, platform, targets, analysis):
+    '''
+    Find object libraries of the same directory that are compiled with
+    identical flags, include directories and defines, and plan one INTERFACE
+    library holding these properties for each such set, defined by the first
+    of these targets and linked by all of their object libraries.
+    '''
+    groups = defaultdict(list)
+    for name, target in targets.iteritems():
+        if not has_object_libraries(name, target, analysis):
+            continue
+
+        sources_properties_by_category = get_sources_properties_by_category(
+                                                      platform,
+                                                      target,
+                                                      get_target_sources(target))
+        for category, sources_properties in sources_properties_by_category.iteritems():
+            _, properties = sources_properties
+            key = (get_target_path(name),
+                   category,
+                   get_object_library_signature(target, properties))
+            groups[key].append(name)
+
+    for (_, category, _), names in groups.iteritems():
+        if len(names) < 2:
+            continue
+
+        names   = sorted(names)
+        digest  = hashlib.sha1('\n'.join(names)).hexdigest()[:8]
+        profile = '{}-profile-{}-{}'.format(unqualify_name(names[0]),
+                                            category,
+                                            digest)
+        plan.profile_owners.setdefault(names[0], []).append((profile, category))
+        for name in names:
+            plan.profiles[(name, category)] = profile
+
+    for profiles in plan.profile_owners.itervalues():
+        profiles.sort()
+
+def plan_generated_outputs(plan, targets):
+    for name, target in targets.iteritems():
+        outputs = [output for action in target.actions \
+                          for output in action.outputs]
+        if len(outputs):
+            plan.generated_outputs[name] = outputs
+        for output in outputs:
+            plan.producers.setdefault(output, name)
+
+def check_dependency_cycles(edges):
+    state = {}
+    for root in sorted(edges):
+        if root in state:
+            continue
+
+        state[root] = 'visiting'
+        path        = [root]
+        stack       = [iter(edges[root])]
+        while len(stack):
+            for child in stack[-1]:
+                if child not in edges:
                     continue
+                if state.get(child) == 'visiting':
+                    cycle = path[path.index(child):] + [child]
+                    raise RuntimeError('Dependency cycle: {}'.format(
+                                                            ' -> '.join(cycle)))
+                if child not in state:
+                    state[child] = 'visiting'
+                    path.append(child)
+                    stack.append(iter(edges[child]))
+                    break
+            else:
+                state[path.pop()] = 'visited'
+                stack.pop()
+
+def get_descendants(name, edges, descendants):
+    if name not in descendants:
+        result = set()
+        for child in edges.get(name, []):
+            result.add(child)
+            result |= get_descendants(child, edges, descendants)
+        descendants[name] = result
+    return descendants[name]
+
+def plan_dependencies(plan, targets, analysis):
+    '''
+    Remove duplicate dependencies of every target, and link dependencies
+    that CMake already propagates through the 'PUBLIC' or 'INTERFACE' link
+    dependencies of another dependency.  Dependencies on generated libraries
+    and executables are only ordering dependencies of object libraries, which
+    are not propagated, so only their duplicates are removed.  Raise an error
+    if the dependencies have a cycle.
+    '''
+    edges      = OrderedDict()
+    link_edges = {}
+    for name, target in targets.iteritems():
+        edges[name] = remove_duplicates(target.dependencies + \
+                                        target.dependencies_original)
 
-                writer.object_library(unqualified_name, category, sources)
-                generate_config_properties(writer,
-                                           '{}-{}'.format(unqualified_name, category),
-                                           target,
-                                           properties.compile_flags,
-                                           'target_compile_options')
-                generate_config_properties(writer,
-                                           '{}-{}'.format(unqualified_name, category),
-                                           target,
-                                           properties.include_dirs,
-                                           'target_include_directories')
-                generate_config_properties(writer,
-                                           '{}-{}'.format(unqualified_name, category),
-                                           target,
-                                           properties.defines,
-                                           'target_compile_definitions',
-                                           True)
-
-                generated_sources = [s for s in sources if s in analysis['all_generated_sources']]
-                if len(generated_sources) > 0:
-                    writer.generated_sources(generated_sources)
-
-                writer.properties('add_dependencies',
-                                  '{}-{}'.format(unqualified_name, category),
-                                  nonlink_dependencies)
-
-            for copy in target.get('copies', []):
-                writer.copies(copy['destination'], copy['files'])
-
-            writer.target(target_type,
-                          library_type,
-                          unqualified_name,
-                          sources_properties_by_category.keys())
-
-            generate_config_properties(writer,
-                                       unqualified_name,
-                                       target,
-                                       lambda _, target: link_dependencies + target.get('libraries', []) + target.get('ldflags', []),
-                                       'target_link_libraries')
-        writer.platform_end()
+        # Only these targets write their link dependencies.
+        if name in analysis.interface_libraries or \
+           (target.type in OBJECT_LIBRARY_TARGET_TYPES and \
+            name not in analysis.generated_libraries):
+            link_edges[name] = [dependency for dependency in edges[name] \
+                                if is_link_dependency(dependency, analysis)]
+
+    check_dependency_cycles(edges)
+
+    descendants = {}
+    for name, dependencies in edges.iteritems():
+        implied = set()
+        for dependency in dependencies:
+            if is_link_dependency(dependency, analysis):
+                implied |= get_descendants(dependency, link_edges, descendants)
+
+        plan.dependencies[name] = split_dependencies(
+                            [dependency for dependency in dependencies \
+                                        if dependency not in implied],
+                            analysis)
+
+def plan_shared_objects(plan, platform, targets, analysis):
+    '''
+    Find sources that are compiled by several targets of the same directory
+    with identical properties, and plan one object library for each set of
+    targets sharing sources, defined by the first of them, instead of
+    compiling these sources once for every target.
+    '''
+    groups = defaultdict(dict)
+    for name, target in targets.iteritems():
+        if not has_object_libraries(name, target, analysis):
+            continue
+
+        _, nonlink_dependencies, _ = get_planned_dependencies(name,
+                                                              target,
+                                                              analysis,
+                                                              plan)
+        sources_properties_by_category = get_sources_properties_by_category(
+                                                      platform,
+                                                      target,
+                                                      get_target_sources(target))
+        for category, sources_properties in sources_properties_by_category.iteritems():
+            sources, properties = sources_properties
+            key = (get_target_path(name),
+                   category,
+                   target.type == 'shared_library',
+                   get_object_library_signature(target, properties))
+            groups[key][name] = ({s for s in sources if not is_header(s)},
+                                 nonlink_dependencies)
+
+    for (_, category, _, _), members in groups.iteritems():
+        if len(members) < 2:
+            continue
+
+        consumers = defaultdict(set)
+        for name, (sources, _) in members.iteritems():
+            for source in sources:
+                consumers[source].add(name)
+
+        sources_by_consumers = defaultdict(set)
+        for source, names in consumers.iteritems():
+            if len(names) > 1:
+                sources_by_consumers[frozenset(names)].add(source)
+
+        for names, sources in sources_by_consumers.iteritems():
+            names       = sorted(names)
+            digest      = hashlib.sha1('\n'.join(names)).hexdigest()[:8]
+            shared_name = '{}-shared-{}'.format(unqualify_name(names[0]), digest)
+
+            dependencies = remove_duplicates([dependency for name in names \
+                                              for dependency in members[name][1]])
+            plan.shared_libraries.setdefault(names[0], []).append(
+                (shared_name, category, sorted(sources), dependencies, names))
+            for name in names:
+                plan.shared_objects.setdefault(name, {}).setdefault(
+                                  category, []).append((shared_name, sources))
+
+    for shared_libraries in plan.shared_libraries.itervalues():
+        shared_libraries.sort()
+    for shared_objects in plan.shared_objects.itervalues():
+        for shared in shared_objects.itervalues():
+            shared.sort()
+
+def get_target_counts(platform, target, sources, contents):
+    '''
+    Return the counts that '--stats' reports for a target: its sources,
+    actions and dependencies, its flags, defines and include directories
+    summed over the categories of its sources and the configurations, and
+    the lines of CMake written for it.
+    '''
+    counts = {
+        'sources':       len(sources),
+        'actions':       len(target.actions),
+        'dependencies':  len(set(target.dependencies)),
+        'compile_flags': 0,
+        'defines':       0,
+        'include_dirs':  0,
+        'link_flags':    0,
+        'lines':         contents.count('\n'),
+    }
+    configurations = [(name, target.configurations[name]) \
+                      for name in sorted(CONFIGURATIONS)   \
+                      if name in target.configurations]
+    for _, properties in get_sources_properties_by_category(platform,
+                                                            target,
+                                                            sources).itervalues():
+        for name, configuration in configurations:
+            counts['compile_flags'] += len(properties.compile_flags(name, configuration))
+            counts['defines']       += len(properties.defines(name, configuration))
+            counts['include_dirs']  += len(properties.include_dirs(name, configuration))
+    for name, configuration in configurations:
+        counts['link_flags'] += len(configuration.libraries) + len(configuration.ldflags)
+    return counts
+
+def generate_target(platform, name, target, analysis, plan, options):
+    unqualified_name = unqualify_name(name)
+    path             = get_target_path(name)
 
-    return lists, unqualified_name
+    lists = os.path.join(path, 'CMakeLists.txt')
+    cmake = os.path.join(path, '{}.cmake'.format(unqualified_name))
 
-def generate_target_cmakes(platform, targets, analysis, all_targets):
-    all_lists   = defaultdict(set)
+    output = OutputFile()
+    writer = HoistingWriter(output, options) if options.hoist \
+                                             else Writer(output, options)
+    writer.platform_start(platform)
+    for action in target.actions:
+        writer.custom_action(action)
+    target_sources = get_target_sources(target)
+    sources        = target_sources
+
+    link_dependencies, nonlink_dependencies, all_dependencies = \
+                          get_planned_dependencies(name, target, analysis, plan)
+
+    target_type = None
+    library_type = None
+    if target.type == 'static_library':
+        target_type = 'library'
+        library_type = 'STATIC'
+    elif target.type == 'shared_library':
+        target_type = 'library'
+        library_type = 'SHARED'
+    elif target.type == 'executable':
+        target_type = 'executable'
+
+    if name in analysis.generated_libraries:
+        # Without the blanket ordering of their consumers, the actions of
+        # generated libraries must wait for the tools they run themselves.
+        action_dependencies = []
+        if options.fine_grained_deps:
+            action_dependencies = nonlink_dependencies
+        writer.custom_target(unqualified_name, sources, action_dependencies)
+    elif name in analysis.interface_libraries:
+        if len(sources) > 0:
+            action_target = '{}-{}'.format(unqualified_name, 'actions')
+            writer.custom_target(action_target, sources, all_dependencies)
+            nonlink_dependencies.append(action_target)
+
+        # TBD: do we need to export 'c' flags also?
+        properties = get_properties_factory(platform, target, 'cc')
+
+        writer.interface_library(unqualified_name)
+        generate_config_properties(writer,
+                                   unqualified_name,
+                                   target,
+                                   properties.compile_flags,
+                                   'target_compile_options')
+        generate_config_properties(writer,
+                                   unqualified_name,
+                                   target,
+                                   properties.include_dirs,
+                                   'target_include_directories')
+        generate_config_properties(writer,
+                                   unqualified_name,
+                                   target,
+                                   properties.defines,
+                                   'target_compile_definitions',
+                                   True)
+        generate_config_properties(writer,
+                                   unqualified_name,
+                                   target,
+                                   lambda _, target: link_dependencies,
+                                   'target_link_libraries')
+
+        writer.properties('add_dependencies', unqualified_name, nonlink_dependencies)
+    elif target_type:
+        sources_properties_by_category = get_sources_properties_by_category(platform, target, sources)
+        for profile, category in plan.profile_owners.get(name, []):
+            writer.interface_library(profile)
+            generate_compile_properties(writer,
+                                        profile,
+                                        target,
+                                        sources_properties_by_category[category][1])
+
+        shared_libraries = plan.shared_libraries.get(name, [])
+        shared_objects   = plan.shared_objects.get(name, {})
+        object_libraries = []
+        for category, sources_properties in sources_properties_by_category.iteritems():
+            sources, properties = sources_properties
+            for shared_name, shared_category, shared_sources, dependencies, consumers in shared_libraries:
+                if shared_category == category:
+                    generate_object_library(writer,
+                                            shared_name,
+                                            category,
+                                            shared_sources,
+                                            target,
+                                            properties,
+                                            analysis,
+                                            dependencies,
+                                            consumers,
+                                            plan,
+                                            options)
+
+            for shared_name, shared_sources in shared_objects.get(category, []):
+                sources = sources - shared_sources
+                object_libraries.append('{}-{}'.format(shared_name, category))
+
+            if all(is_header(source) for source in sources):
+                continue
+
+            generate_object_library(writer,
+                                    unqualified_name,
+                                    category,
+                                    sources,
+                                    target,
+                                    properties,
+                                    analysis,
+                                    nonlink_dependencies,
+                                    [name],
+                                    plan,
+                                    options)
+            object_libraries.append('{}-{}'.format(unqualified_name, category))
+
+        copies_target = '{}-{}'.format(unqualified_name, 'copies')
+        if len(target.copies):
+            writer.copies(copies_target, path, target.copies)
+
+        writer.target(target_type,
+                      library_type,
+                      unqualified_name,
+                      object_libraries)
+
+        if len(target.copies):
+            writer.properties('add_dependencies', unqualified_name, [copies_target])
+
+        if options.perf_profile and (target.type != 'static_library' or \
+                                     in_pool(name, options.link_pool)):
+            writer.job_pool(unqualified_name, 'JOB_POOL_LINK', LINK_POOL)
+
+        generate_config_properties(writer,
+                                   unqualified_name,
+                                   target,
+                                   lambda _, configuration: link_dependencies + list(configuration.libraries) + list(configuration.ldflags),
+                                   'target_link_libraries')
+    writer.platform_end()
+
+    hoisted  = writer.hoisted if options.hoist else []
+    contents = output.getvalue()
+    counts   = None
+    if options.stats:
+        counts = get_target_counts(platform, target, target_sources, contents)
+    return lists, cmake, unqualified_name, contents, hoisted, counts
+
+_worker_state = {}
+
+def init_worker(platform, analysis, plan, options):
+    _worker_state['platform'] = platform
+    _worker_state['analysis'] = analysis
+    _worker_state['plan']     = plan
+    _worker_state['options']  = options
+
+def generate_target_worker(item):
+    name, target = item
+    return generate_target(_worker_state['platform'],
+                           name,
+                           target,
+                           _worker_state['analysis'],
+                           _worker_state['plan'],
+                           _worker_state['options'])
+
+class TargetCache(object):
+    '''
+    The results of 'generate_target' for the targets of each platform, by a
+    fingerprint of everything they depend on, so that '--watch' only
+    generates the targets whose definitions changed.  Results that are not
+    used by a run are forgotten at the start of the next one.
+    '''
+    def __init__(self):
+        self._results  = {}
+        self._previous = {}
+        self.generated = 0
+        self.reused    = 0
+
+    def start(self):
+        self._previous = self._results
+        self._results  = {}
+        self.generated = 0
+        self.reused    = 0
+
+    def abort(self):
+        # Keep the results that a failed run did not get to.
+        self._results.update(self._previous)
+        self._previous = {}
+
+    def lookup(self, key):
+        if key in self._previous:
+            self._results[key] = self._previous.pop(key)
+            self.reused += 1
+        return self._results.get(key)
+
+    def store(self, key, result):
+        self._results[key] = result
+        self.generated += 1
+
+def get_canonical(value):
+    '''
+    Return 'value' as nested lists whose 'repr' does not depend on the order
+    of its sets and dictionaries, with objects replaced by their slots.
+    '''
+    if isinstance(value, dict):
+        return sorted([get_canonical(k), get_canonical(v)] for k, v in value.iteritems())
+    if isinstance(value, (set, frozenset)):
+        return sorted(get_canonical(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return [get_canonical(v) for v in value]
+    if hasattr(value, '__slots__'):
+        return [get_canonical(getattr(value, field)) for field in value.__slots__]
+    return value
+
+def get_fingerprint(value):
+    return hashlib.sha1(repr(get_canonical(value))).hexdigest()
+
+def get_planned(name, plan):
+    '''
+    Return the parts of 'plan' that 'generate_target' uses for the target
+    'name', other than the outputs of all actions.
+    '''
+    return [plan.shared_libraries.get(name),
+            plan.shared_objects.get(name),
+            plan.dependencies.get(name),
+            plan.profile_owners.get(name),
+            [plan.profiles.get((name, category)) for category in sorted(SOURCE_CATEGORIES)]]
+
+def generate_cached_targets(platform, targets, analysis, plan, options, cache):
+    # The output of every target also depends on the analysis of its platform
+    # and on the outputs of all actions, which few edits change.
+    context = get_fingerprint([platform,
+                               analysis,
+                               plan.generated_outputs,
+                               plan.producers])
+    keys    = []
+    missing = OrderedDict()
+    for name, target in get_known_targets(targets):
+        key = (platform, name, get_fingerprint([context,
+                                                target,
+                                                get_planned(name, plan)]))
+        keys.append(key)
+        if cache.lookup(key) is None:
+            missing[name] = target
+
+    results = iter([])
+    if len(missing):
+        results = iter(list(generate_targets(platform,
+                                             missing,
+                                             analysis,
+                                             plan,
+                                             options)))
+    for key in keys:
+        result = cache.lookup(key)
+        if result is None:
+            result = next(results)
+            cache.store(key, result)
+        yield result
+
+def get_known_targets(targets):
     for name, target in targets.iteritems():
-        if target['type'] not in KNOWN_TARGET_TYPES:
-            raise RuntimeError('Unknown target type: {}'.format(target['type']))
-
-        target['sources'] = target.get('sources', [])
-        target['actions'] = target.get('actions', [])
-
-        lists, unqualified_name = generate_target(platform,
-                                                  name,
-                                                  target,
-                                                  analysis,
-                                                  all_targets)
-        if unqualified_name in all_lists[lists]:
-            raise RuntimeError(
-                  'Multiple targets with the same name: {} in {}'.format(lists,
-                                                                         unqualified_name))
-        all_lists[lists].add(unqualified_name)
-
-    with open('CMakeLists.txt', 'w') as f:
-        print('cmake_minimum_required(VERSION 3.8)\n', file=f)
+        if target.type not in KNOWN_TARGET_TYPES:
+            raise RuntimeError('Unknown target type: {}'.format(target.type))
+
+        yield name, target
+
+def generate_targets(platform, targets, analysis, plan, options):
+    jobs = options.jobs
+    if jobs <= 1:
+        for name, target in get_known_targets(targets):
+            yield generate_target(platform, name, target, analysis, plan, options)
+        return
+
+    pool = multiprocessing.Pool(jobs,
+                                initializer=init_worker,
+                                initargs=(platform, analysis, plan, options))
+    try:
+        chunksize = max(1, len(targets) // (jobs * 4))
+        for result in pool.imap(generate_target_worker,
+                                get_known_targets(targets),
+                                chunksize):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+def generate_target_cmakes(outputs,
+                           platform,
+                           targets,
+                           analysis,
+                           all_targets,
+                           hoisted,
+                           options,
+                           statistics,
+                           cache=None):
+    # Targets may be generated out of process, but everything that is shared
+    # between targets is merged here, in the original target order, so that
+    # the output does not depend on the number of jobs.
+    plan = Plan()
+    with statistics.phase('plan/{}'.format(platform)):
+        if options.reduce_deps or options.share_objects or \
+           options.fine_grained_deps or options.profiles:
+            # Each planning pass and the generation read every target, so
+            # the targets of a store are only loaded once, for this platform.
+            targets = OrderedDict(targets.iteritems())
+        if options.reduce_deps:
+            plan_dependencies(plan, targets, analysis)
+        if options.share_objects:
+            plan_shared_objects(plan, platform, targets, analysis)
+        if options.fine_grained_deps:
+            plan_generated_outputs(plan, targets)
+        if options.profiles:
+            plan_profiles(plan, platform, targets, analysis)
+
+    with statistics.phase('generate/{}'.format(platform)):
+        all_lists = defaultdict(set)
+        if cache is None:
+            results = generate_targets(platform, targets, analysis, plan, options)
+        else:
+            results = generate_cached_targets(platform,
+                                              targets,
+                                              analysis,
+                                              plan,
+                                              options,
+                                              cache)
+        for lists, cmake, unqualified_name, contents, records, counts in results:
+            if unqualified_name not in all_targets[lists]:
+                all_targets[lists].append(unqualified_name)
+                with outputs.open(lists) as f:
+                    print('include({})'.format(os.path.basename(cmake)), file=f)
+
+            with outputs.open(cmake) as f:
+                f.write(contents)
+
+            for property_name, target_name, interface, general, specific, reorderable in records:
+                key = (property_name, target_name)
+                hoisted[cmake].setdefault(key, {})[platform] = (interface,
+                                                                general,
+                                                                specific,
+                                                                reorderable)
+
+            if unqualified_name in all_lists[lists]:
+                raise RuntimeError(
+                      'Multiple targets with the same name: {} in {}'.format(lists,
+                                                                             unqualified_name))
+            all_lists[lists].add(unqualified_name)
+
+            if counts is not None:
+                statistics.count(platform, cmake, counts)
+
+    clear_platform_caches()
+
+def generate_top_level_lists(outputs, all_targets, options):
+    '''
+    Write the top-level 'CMakeLists.txt', which includes the targets of every
+    platform, once all platforms have been generated.
+    '''
+    with outputs.open('CMakeLists.txt', 'w') as f:
+        print('cmake_minimum_required(VERSION {})\n'.format(
+                                    get_cmake_minimum_version(options)), file=f)
+        # Depfiles of actions name their outputs by absolute path, which
+        # Ninja only matches when CMake rewrites them.
+        print('if(POLICY CMP0116)', file=f)
+        print('    cmake_policy(SET CMP0116 NEW)', file=f)
+        print('endif()\n', file=f)
+        if options.multi_config:
+            print('set(CMAKE_CONFIGURATION_TYPES {})\n'.format(
+                                    ' '.join(sorted(CONFIGURATIONS))), file=f)
         print('file(WRITE {}/dummy.cc "")\n'.format(GENERATED), file=f)
-        for lists, targets in all_lists.iteritems():
+        if options.perf_profile:
+            print(PERFORMANCE_PROFILE, file=f)
+        if options.action_cache:
+            print('set(NCG_ACTION_CACHE "$ENV{NCG_ACTION_CACHE}" CACHE PATH\n'
+                  '    "Directory in which the outputs of GYP actions are cached")',
+                  file=f)
+            print('find_program(NCG_PYTHON NAMES python3 python)\n', file=f)
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'action_cache.py'), 'r') as script:
+                with outputs.open(ACTION_CACHE_SCRIPT, 'w') as output:
+                    output.write(script.read())
+        if options.copy_mode != 'copy':
+            # 'file(CREATE_LINK)' does not create the directory of the link,
+            # and would copy the file instead.
+            print('file(WRITE {} "get_filename_component(DIRECTORY '
+                  '\\"\\${{DESTINATION}}\\" DIRECTORY)\\n'
+                  'file(MAKE_DIRECTORY \\"\\${{DIRECTORY}}\\")\\n'
+                  'file(CREATE_LINK \\"\\${{SOURCE}}\\" '
+                  '\\"\\${{DESTINATION}}\\" COPY_ON_ERROR \\${{MODE}})\\n")\n'.format(
+                                                 CREATE_LINK_SCRIPT), file=f)
+        for lists, targets in sorted(all_targets.iteritems()):
             directory = os.path.dirname(lists)
             if directory == '':
                 for target in targets:
@@ -452,18 +1921,255 @@ def generate_target_cmakes(platform, targets, analysis, all_targets):
             else:
                 print('add_subdirectory({})'.format(directory), file=f)
 
+def get_cmake_minimum_version(options):
+    version = (3, 8)
+    if options.hoist:
+        # OBJECT libraries without sources, to which sources are added later
+        # using 'target_sources'.
+        version = max(version, (3, 11))
+    if options.copy_mode != 'copy':
+        # 'file(CREATE_LINK)'
+        version = max(version, (3, 14))
+    if options.profiles:
+        # 'target_link_libraries' on OBJECT libraries, and relative include
+        # directories on INTERFACE libraries.
+        version = max(version, (3, 13))
+    if options.perf_profile:
+        # 'check_ipo_supported' and 'cmake_host_system_information' of the
+        # physical memory.
+        version = max(version, (3, 10))
+    if options.unity or options.pch:
+        version = max(version, (3, 16))
+
+    return '.'.join(str(v) for v in version)
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+                      description='Generate CMake files from a GYP analysis.')
+    parser.add_argument('--analysis',
+                        help='analysis file or sharded analysis store to read '
+                             '(default: {} if it exists, otherwise {})'.format(
+                                                  ANALYSIS_STORE, ANALYSIS_FILE))
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='only write files whose contents changed and '
+                             'remove files no longer generated')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        help='number of processes used to generate targets')
+    parser.add_argument('--hoist',
+                        action='store_true',
+                        help='write sources and properties that are common to '
+                             'all platforms and configurations only once')
+    parser.add_argument('--share-objects',
+                        action='store_true',
+                        help='compile sources shared by several targets with '
+                             'identical properties only once')
+    parser.add_argument('--unity',
+                        action='store_true',
+                        help='build object libraries as unity (jumbo) '
+                             'sources, except generated sources and sources '
+                             'listed in <target>.unity-exclude files')
+    parser.add_argument('--unity-batch-size',
+                        type=int,
+                        default=16,
+                        help='maximum number of sources combined into one '
+                             'unity source (default: %(default)s)')
+    parser.add_argument('--pch',
+                        action='store_true',
+                        help='precompile the headers most object library '
+                             'sources include first')
+    parser.add_argument('--pch-threshold',
+                        type=float,
+                        default=0.5,
+                        help='fraction of the sources of an object library '
+                             'that must include a header for it to be '
+                             'precompiled (default: %(default)s)')
+    parser.add_argument('--profiles',
+                        action='store_true',
+                        help='write the compile properties shared by the '
+                             'object libraries of several targets once, in '
+                             'INTERFACE libraries that they link')
+    parser.add_argument('--reduce-deps',
+                        action='store_true',
+                        help='remove duplicate dependencies and link '
+                             'dependencies implied by other dependencies')
+    parser.add_argument('--fine-grained-deps',
+                        action='store_true',
+                        help='make each source wait only for the generated '
+                             'headers it includes instead of making every '
+                             'object library wait for all the generated '
+                             'libraries and executables its target depends '
+                             'on (requires a Ninja generator)')
+    parser.add_argument('--copy-mode',
+                        choices=('copy', 'hardlink', 'symlink'),
+                        default='copy',
+                        help='how files listed in GYP copies are copied at '
+                             'build time (default: %(default)s)')
+    parser.add_argument('--action-cache',
+                        action='store_true',
+                        help='run GYP actions through {}, which restores '
+                             'their outputs from the directory set by the '
+                             'NCG_ACTION_CACHE CMake variable or environment '
+                             'variable'.format(ACTION_CACHE_SCRIPT))
+    parser.add_argument('--perf-profile',
+                        action='store_true',
+                        help='link with mold or lld if available, enable '
+                             'IPO for Release, split DWARF for Debug on '
+                             'Linux, and limit parallel heavyweight links '
+                             'and compiles using Ninja job pools')
+    parser.add_argument('--link-pool',
+                        action='append',
+                        metavar='PATTERN',
+                        help='static libraries linked in the link job pool, '
+                             'in addition to executables and shared '
+                             'libraries (default: libnode)')
+    parser.add_argument('--compile-pool',
+                        action='append',
+                        metavar='PATTERN',
+                        help='targets whose sources are compiled in the '
+                             'compile job pool (default: v8_*)')
+    parser.add_argument('--multi-config',
+                        action='store_true',
+                        help='select per-configuration properties using '
+                             'generator expressions instead of '
+                             'CMAKE_BUILD_TYPE, for multi-config generators')
+    parser.add_argument('--prune-includes',
+                        action='store_true',
+                        help='only pass the include directories that resolve '
+                             'an include of the sources of each object '
+                             'library, or of the headers they reach, most '
+                             'used first')
+    parser.add_argument('--watch',
+                        action='store_true',
+                        help='keep running, and generate the targets whose '
+                             'definitions changed whenever the analysis is '
+                             'written again')
+    parser.add_argument('--watch-interval',
+                        type=float,
+                        default=1.0,
+                        help='seconds between checks of the analysis when '
+                             'inotify is not available, and seconds without '
+                             'changes to wait for before generating '
+                             '(default: %(default)s)')
+    parser.add_argument('--stats',
+                        metavar='FILE',
+                        help='write the time spent in each phase and counts '
+                             'of the sources, flags and CMake lines of each '
+                             'target to this JSON file')
+    parser.add_argument('--profile',
+                        metavar='FILE',
+                        help='write cProfile statistics of the run to this '
+                             'file (targets generated by --jobs workers are '
+                             'not profiled)')
+
+    options = parser.parse_args(args)
+    if options.link_pool is None:
+        options.link_pool = ['libnode']
+    if options.compile_pool is None:
+        options.compile_pool = ['v8_*']
+    return options
+
+def generate_all(platforms, options, statistics, incremental, cache=None):
+    if cache is not None:
+        cache.start()
+
+    outputs = OutputTree()
+    all_targets = defaultdict(list)
+    all_platforms = set()
+    hoisted = defaultdict(OrderedDict)
+    for name, platform in sorted(platforms.iteritems()):
+        cmake_os = get_cmake_os(name)
+        print('Generating files for platform: {}'.format(cmake_os))
+        generate_target_cmakes(outputs,
+                               cmake_os,
+                               platform.targets,
+                               platform.analysis,
+                               all_targets,
+                               hoisted,
+                               options,
+                               statistics,
+                               cache)
+        all_platforms.add(cmake_os)
+
+    with statistics.phase('hoist'):
+        generate_all_hoisted_properties(outputs, hoisted, all_platforms, options)
+    generate_top_level_lists(outputs, all_targets, options)
+
+    with statistics.phase('write'):
+        return outputs.commit(incremental)
+
+def get_analysis_paths(analysis):
+    # The index of a store is written after the targets of each platform.
+    if store.is_store(analysis):
+        return [os.path.join(analysis, store.INDEX_FILE)]
+    return [analysis]
+
+def watch_analysis(options, cache):
+    watcher = watch.get_watcher(get_analysis_paths(options.analysis),
+                                options.watch_interval)
+    print('Watching {} for changes'.format(options.analysis))
+    try:
+        while True:
+            watch.wait_for_change(watcher, options.watch_interval)
+
+            # Only the targets whose definitions changed are generated again,
+            # so nothing read for the previous run may be reused.
+            clear_caches()
+            statistics = stats.Stats()
+            try:
+                platforms        = model.load(options.analysis)
+                written, removed = generate_all(platforms,
+                                                options,
+                                                statistics,
+                                                True,
+                                                cache)
+            except (RuntimeError, IOError, OSError, ValueError) as e:
+                # E.g. a dependency cycle, or a shard of a store read while
+                # it is replaced: the next change may fix it.
+                print('Cannot generate files from {}: {}'.format(options.analysis, e))
+                cache.abort()
+                continue
+            print('Generated {} targets, reused {}; wrote {} files, removed '
+                  '{} stale files'.format(cache.generated,
+                                          cache.reused,
+                                          written,
+                                          removed))
+            if options.stats:
+                statistics.dump(options.stats)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
 def main():
-    with open(ANALYSIS_FILE, 'r') as f:
-        all_platforms = json.load(f)
-        all_targets = set()
-        for platform, data in all_platforms.iteritems():
-            cmake_os = get_cmake_os(platform)
-            print('Writing files for platform: {}'.format(cmake_os))
-            generate_target_cmakes(cmake_os,
-                                   data['targets'],
-                                   data['analysis'],
-                                   all_targets)
+    options = parse_args()
+    if options.analysis is None:
+        options.analysis = ANALYSIS_FILE
+        if store.is_store(ANALYSIS_STORE):
+            options.analysis = ANALYSIS_STORE
+
+    cache      = TargetCache() if options.watch else None
+    statistics = stats.Stats()
+    with stats.profiled(options.profile):
+        # A sharded store only loads its index here, and each target when it
+        # is generated.
+        with statistics.phase('load'):
+            platforms = model.load(options.analysis)
+
+        written, removed = generate_all(platforms,
+                                        options,
+                                        statistics,
+                                        options.incremental,
+                                        cache)
+    print('Wrote {} files, removed {} stale files'.format(written, removed))
+
+    if options.stats:
+        statistics.dump(options.stats)
+
+    if options.watch:
+        watch_analysis(options, cache)
 
 if __name__ == '__main__':
     main()
-
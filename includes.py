@@ -0,0 +1,204 @@
+import os
+import re
+
+from collections import defaultdict
+
+INCLUDE   = re.compile(r'\s*#\s*include\s*([<"])([^>"]+)[>"]')
+DIRECTIVE = re.compile(r'\s*#\s*include')
+
+_prefixes    = {}
+_includes    = {}
+_unscannable = set()
+_generated   = {}
+_files       = {}
+
+def clear():
+    '''
+    Forget the contents of all the files read so far, e.g. before generating
+    again in '--watch' mode.
+    '''
+    for cache in (_prefixes, _includes, _unscannable, _generated, _files):
+        cache.clear()
+
+def read_lines(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().splitlines()
+    except (IOError, OSError):
+        return None
+
+def get_include_prefix(path):
+    '''
+    Return the '(kind, header)' pairs, where 'kind' is '<' or '"', of the
+    includes at the start of the file at 'path', before any other directive
+    or code, or 'None' if the file cannot be read.
+    '''
+    if path in _prefixes:
+        return _prefixes[path]
+
+    lines = read_lines(path)
+    if lines is None:
+        _prefixes[path] = None
+        return None
+
+    prefix  = []
+    comment = False
+    for line in lines:
+        if comment:
+            if '*/' not in line:
+                continue
+            line    = line.split('*/', 1)[1]
+            comment = False
+
+        line = line.split('//', 1)[0]
+        if '/*' in line:
+            before, after = line.split('/*', 1)
+            if '*/' in after:
+                line = before + after.split('*/', 1)[1]
+            else:
+                line    = before
+                comment = True
+
+        if line.strip() == '':
+            continue
+
+        match = INCLUDE.match(line)
+        if match is None:
+            break
+        prefix.append((match.group(1), match.group(2)))
+
+    _prefixes[path] = prefix
+    return prefix
+
+def get_includes(path):
+    '''
+    Return the '(kind, header)' pairs of every include in the file at 'path',
+    including conditional ones, or 'None' if the file cannot be read.
+    '''
+    if path in _includes:
+        return _includes[path]
+
+    lines = read_lines(path)
+    if lines is None:
+        _includes[path] = None
+        return None
+
+    result = []
+    for line in lines:
+        match = INCLUDE.match(line)
+        if match is not None:
+            result.append((match.group(1), match.group(2)))
+        elif DIRECTIVE.match(line):
+            # '#include MACRO' or '#include_next'
+            _unscannable.add(path)
+
+    _includes[path] = result
+    return result
+
+def is_scannable(path):
+    '''
+    Return whether the file at 'path' can be read and names the header of
+    each of its includes literally.
+    '''
+    return get_includes(path) is not None and path not in _unscannable
+
+def get_generated_headers(path, include_dirs, generated_suffixes):
+    '''
+    Return the generated headers that the file at 'path' includes, directly
+    or through other headers, when compiled with 'include_dirs'.
+    'generated_suffixes' maps the trailing parts of the paths of generated
+    files to these files.  Return 'None' if 'path' cannot be read.
+    '''
+    include_dirs = tuple(include_dirs)
+    key          = (path, include_dirs)
+    if key in _generated:
+        return _generated[key]
+
+    if get_includes(path) is None:
+        _generated[key] = None
+        return None
+
+    result  = set()
+    visited = {path}
+    pending = [path]
+    while len(pending):
+        current   = pending.pop()
+        directory = os.path.dirname(current)
+        for kind, header in get_includes(current) or []:
+            found = resolve(header, kind, directory, include_dirs)
+            if found is None:
+                result.update(generated_suffixes.get(header, []))
+            elif found not in visited:
+                visited.add(found)
+                pending.append(found)
+
+    _generated[key] = sorted(result)
+    return _generated[key]
+
+def get_include_dir_hits(paths, include_dirs, generated_suffixes):
+    '''
+    Return how many includes each of 'include_dirs' resolves when compiling
+    each of the files at 'paths', counting the includes of every header
+    reached, and the pairs '(a, b)' of these directories such that 'a' must
+    stay before 'b' for every include to resolve to the same file.  Return
+    'None' if any file reached cannot be scanned, or includes a generated
+    header, whose own includes are not known.
+    '''
+    hits        = defaultdict(int)
+    constraints = set()
+    for path in paths:
+        visited = {path}
+        pending = [path]
+        while len(pending):
+            current = pending.pop()
+            if not is_scannable(current):
+                return None
+
+            directory = os.path.dirname(current)
+            for kind, header in get_includes(current):
+                found = None
+                if kind == '"':
+                    found = os.path.normpath(os.path.join(directory, header))
+                    if not is_file(found):
+                        found = None
+                if found is None:
+                    candidates = [include_dir for include_dir in include_dirs \
+                                  if is_file(os.path.normpath(os.path.join(include_dir,
+                                                                           header)))]
+                    if len(candidates) == 0:
+                        if header in generated_suffixes:
+                            return None
+                        continue
+
+                    hits[candidates[0]] += 1
+                    for candidate in candidates[1:]:
+                        constraints.add((candidates[0], candidate))
+                    found = os.path.normpath(os.path.join(candidates[0], header))
+
+                if found not in visited:
+                    visited.add(found)
+                    pending.append(found)
+
+    return hits, constraints
+
+def resolve(header, kind, directory, include_dirs):
+    '''
+    Return the path of the file found for '#include <header>' (if 'kind' is
+    '<') or '#include "header"' (if 'kind' is '"') in a file in 'directory'
+    compiled with 'include_dirs', or 'None' if it is not found there (e.g.
+    because it is a system header).
+    '''
+    candidates = include_dirs
+    if kind == '"':
+        candidates = [directory] + list(include_dirs)
+
+    for candidate in candidates:
+        path = os.path.normpath(os.path.join(candidate, header))
+        if is_file(path):
+            return path
+    return None
+
+def is_file(path):
+    if path not in _files:
+        _files[path] = os.path.isfile(path)
+    return _files[path]
@@ -0,0 +1,118 @@
+from __future__ import print_function
+
+import sys
+import glob
+import json
+import argparse
+
+import store
+
+ANALYSIS_FILE          = 'gyp_analysis.json'
+ANALYSIS_PLATFORM_FILE = 'gyp_analysis.{}.json'
+ANALYSIS_STORE         = 'gyp_analysis'
+
+KNOWN_PLATFORMS = ('linux', 'darwin', 'win32')
+TARGET_SETS     = ('executables', 'generated_libraries', 'interface_libraries')
+
+def validate_platform(platform, data):
+    if not platform.startswith(KNOWN_PLATFORMS):
+        return ['unknown platform']
+
+    targets  = data.get('targets')
+    analysis = data.get('analysis')
+    if not isinstance(targets, dict):
+        return ['missing targets']
+    if not isinstance(analysis, dict):
+        return ['missing analysis']
+
+    errors = []
+    for name in TARGET_SETS + ('all_generated_sources',):
+        if name not in analysis:
+            errors.append('analysis is missing {}'.format(name))
+
+    for name in TARGET_SETS:
+        for target in analysis.get(name, []):
+            if target not in targets:
+                errors.append('{} lists unknown target {}'.format(name, target))
+
+    for name, target in sorted(targets.iteritems()):
+        if 'type' not in target:
+            errors.append('target {} has no type'.format(name))
+        for field in ('dependencies', 'dependencies_original'):
+            for dependency in target.get(field, []):
+                if dependency not in targets:
+                    errors.append('target {} depends on unknown target {}'.format(
+                                                               name, dependency))
+
+    return errors
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+           description='Combine and validate per-platform GYP analyses written '
+                       'with -G ncg_format=split.')
+    parser.add_argument('inputs',
+                        nargs='*',
+                        help='per-platform analysis files (default: {})'.format(
+                                             ANALYSIS_PLATFORM_FILE.format('*')))
+    parser.add_argument('-o', '--output',
+                        help='combined analysis file or store to write '
+                             '(default: {} or {})'.format(ANALYSIS_FILE,
+                                                           ANALYSIS_STORE))
+    parser.add_argument('--format',
+                        choices=('json', 'sharded'),
+                        default='json',
+                        help='write a single file or a sharded store')
+    parser.add_argument('--compress',
+                        action='store_true',
+                        help='compress the files of a sharded store')
+    return parser.parse_args()
+
+def main():
+    options = parse_args()
+    inputs  = options.inputs or sorted(
+                                   glob.glob(ANALYSIS_PLATFORM_FILE.format('*')))
+    if len(inputs) == 0:
+        print('No analysis files to merge', file=sys.stderr)
+        return 1
+
+    merged  = {}
+    origins = {}
+    errors  = []
+    for path in inputs:
+        with open(path, 'r') as f:
+            data = json.load(f)
+
+        for platform, platform_data in sorted(data.iteritems()):
+            if platform in merged:
+                errors.append('{}: {} was already analysed in {}'.format(
+                                              path, platform, origins[platform]))
+                continue
+
+            errors += ['{}: {}: {}'.format(path, platform, error) \
+                       for error in validate_platform(platform, platform_data)]
+            merged[platform]  = platform_data
+            origins[platform] = path
+
+    if len(errors):
+        for error in errors:
+            print(error, file=sys.stderr)
+        return 1
+
+    if options.format == 'sharded':
+        output = options.output or ANALYSIS_STORE
+        for platform, platform_data in sorted(merged.iteritems()):
+            store.write_platform(output,
+                                 platform,
+                                 platform_data['targets'],
+                                 platform_data['analysis'],
+                                 compress=options.compress)
+    else:
+        output = options.output or ANALYSIS_FILE
+        with store.locked(output):
+            store.dump_json(merged, output, pretty=True)
+
+    print('Merged {} into {}'.format(', '.join(sorted(merged)), output))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import os
+import json
+
+from collections import OrderedDict
+
+import store
+
+EMULATED_PLATFORMS = {'darwin', 'win32'}
+
+# Fields of a target that are consumed directly by the generator and are not
+# needed by the platform emulation settings.
+CONSUMED_FIELDS = {'sources', 'actions', 'copies', 'dependencies',
+                   'dependencies_original'}
+
+_strings = {}
+
+def intern_all(values):
+    return tuple(_strings.setdefault(value, value) for value in values)
+
+class Configuration(object):
+    __slots__ = ('cflags',
+                 'cflags_c',
+                 'cflags_cc',
+                 'defines',
+                 'include_dirs',
+                 'libraries',
+                 'ldflags')
+
+    def __init__(self, data):
+        for field in self.__slots__:
+            setattr(self, field, intern_all(data.get(field, [])))
+
+class Action(object):
+    __slots__ = ('inputs',
+                 'outputs',
+                 'byproducts',
+                 'depfile',
+                 'message',
+                 'action',
+                 'process_outputs_as_sources')
+
+    def __init__(self, data):
+        self.inputs     = tuple(data.get('inputs', []))
+        self.outputs    = tuple(data.get('outputs', []))
+        self.byproducts = tuple(data.get('byproducts', []))
+        self.depfile    = data.get('depfile')
+        self.message    = data.get('message')
+        self.action     = tuple(data.get('action', []))
+        self.process_outputs_as_sources = \
+                               bool(data.get('process_outputs_as_sources', False))
+
+class Copy(object):
+    __slots__ = ('destination', 'files')
+
+    def __init__(self, data):
+        self.destination = data['destination']
+        self.files       = tuple(data.get('files', []))
+
+class Target(object):
+    __slots__ = ('name',
+                 'type',
+                 'sources',
+                 'actions',
+                 'copies',
+                 'dependencies',
+                 'dependencies_original',
+                 'settings',
+                 'configurations',
+                 'spec')
+
+    def __init__(self, name, data, emulated):
+        self.name                  = name
+        self.type                  = data['type']
+        self.sources               = tuple(data.get('sources', []))
+        self.actions               = tuple(Action(action) \
+                                           for action in data.get('actions', []))
+        self.copies                = tuple(Copy(copy) \
+                                           for copy in data.get('copies', []))
+        self.dependencies          = tuple(data.get('dependencies', []))
+        self.dependencies_original = tuple(data.get('dependencies_original', []))
+        self.settings              = Configuration(data)
+        self.configurations        = {
+            name: Configuration(configuration) \
+               for name, configuration in data.get('configurations', {}).iteritems()
+        }
+
+        # The Xcode and MSVS emulation settings need the raw GYP dictionary,
+        # without the (potentially very large) lists that we already hold.
+        self.spec = None
+        if emulated:
+            self.spec = { key: value for key, value in data.iteritems() \
+                                                  if key not in CONSUMED_FIELDS }
+
+class Analysis(object):
+    __slots__ = ('executables',
+                 'generated_libraries',
+                 'interface_libraries',
+                 'all_generated_sources',
+                 'generated_suffixes')
+
+    def __init__(self, data):
+        self.executables           = frozenset(data.get('executables', []))
+        self.generated_libraries   = frozenset(data.get('generated_libraries', []))
+        self.interface_libraries   = frozenset(data.get('interface_libraries', []))
+        self.all_generated_sources = frozenset(data.get('all_generated_sources', []))
+
+        # Every trailing part of the path of each generated source, to find the
+        # generated sources that an '#include' may refer to.
+        self.generated_suffixes = {}
+        for source in sorted(self.all_generated_sources):
+            parts = source.split('/')
+            for i in range(1, len(parts)):
+                self.generated_suffixes.setdefault('/'.join(parts[i:]),
+                                                   []).append(source)
+
+    def is_generated(self, header):
+        return header in self.generated_suffixes
+
+class StoredTargets(object):
+    '''
+    A read-only mapping from target name to 'Target' that loads each target
+    from its shard in the analysis store each time it is accessed, so that
+    only the targets currently being generated are held in memory.  Passes
+    that read every target more than once load them all first.
+    '''
+    def __init__(self, directory, shards, emulated):
+        self._directory = directory
+        self._shards    = shards
+        self._emulated  = emulated
+
+    def __len__(self):
+        return len(self._shards)
+
+    def __contains__(self, name):
+        return name in self._shards
+
+    def __iter__(self):
+        return iter(sorted(self._shards))
+
+    def __getitem__(self, name):
+        return Target(name,
+                      store.read_target(self._directory, self._shards[name]),
+                      self._emulated)
+
+    def iterkeys(self):
+        return iter(self)
+
+    def iteritems(self):
+        for name in self:
+            yield name, self[name]
+
+class Platform(object):
+    __slots__ = ('name', 'targets', 'analysis')
+
+    def __init__(self, name, targets, analysis):
+        self.name     = name
+        self.targets  = targets
+        self.analysis = Analysis(analysis)
+
+def load_file(path):
+    with open(path, 'r') as f:
+        all_platforms = json.load(f)
+
+    result = {}
+    for name, data in all_platforms.iteritems():
+        # Targets are in the same order as in a store, so the output does not
+        # depend on the format of the analysis.
+        emulated = name in EMULATED_PLATFORMS
+        targets  = OrderedDict(
+            (target_name, Target(target_name, target, emulated)) \
+                   for target_name, target in sorted(data['targets'].iteritems())
+        )
+        result[name] = Platform(name, targets, data['analysis'])
+    return result
+
+def load_store(root):
+    index = store.read_index(root)
+
+    result = {}
+    for name, directory in index['platforms'].iteritems():
+        directory = os.path.join(root, directory)
+        data      = store.read_platform(directory)
+        targets   = StoredTargets(directory,
+                                  data['targets'],
+                                  name in EMULATED_PLATFORMS)
+        result[name] = Platform(name, targets, data['analysis'])
+    return result
+
+def load(path):
+    '''
+    Load the analysis written by 'analyse.py', either as a single file or as
+    a sharded store, and return a dictionary from platform name to
+    'Platform'.  Targets in a sharded store are loaded lazily.
+    '''
+    if store.is_store(path):
+        return load_store(path)
+
+    return load_file(path)
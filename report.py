@@ -0,0 +1,335 @@
+from __future__ import print_function
+
+import os
+import re
+import sys
+import hashlib
+import argparse
+import itertools
+
+from collections import defaultdict
+
+import model
+import store
+
+ANALYSIS_FILE  = 'gyp_analysis.json'
+ANALYSIS_STORE = 'gyp_analysis'
+
+COMPILED_EXTENSIONS = {'.c', '.cc', '.cpp', '.cxx'}
+BUILD_DIRECTORY     = '${CMAKE_BINARY_DIR}/'
+OBJECT_DIRECTORY    = re.compile(r'(?:^|/)CMakeFiles/([^/]+)\.dir/')
+SHARED_LIBRARY      = re.compile(r'^(.+)-shared-([0-9a-f]{8})$')
+CATEGORY_SUFFIXES   = ('-c', '-cc', '-actions')
+LINK_SUFFIXES       = re.compile(r'(\.(a|so|dylib|lib|dll|exe)|\.so(\.\d+)+)$')
+
+# Shared object libraries are only matched to the sets of at most this many
+# targets that compile the same source.
+MAX_SHARED_CONSUMERS = 8
+
+def unqualify_name(gyp_target):
+    return gyp_target.split(':')[1].split('#')[0]
+
+def get_target_path(gyp_target):
+    return os.path.dirname(gyp_target.split(':')[0])
+
+def is_compiled(source):
+    return os.path.splitext(source)[1] in COMPILED_EXTENSIONS
+
+def get_source_bytes(name, sources):
+    path   = get_target_path(name)
+    result = 0
+    for source in sources:
+        try:
+            result += os.path.getsize(os.path.join(path, source))
+        except OSError:
+            # Generated sources do not exist before the build.
+            pass
+    return result
+
+def get_graph(targets):
+    '''
+    Return the dependencies of each target: the targets it names, and the
+    targets whose actions produce its action inputs or its sources.
+    '''
+    producers = {}
+    for name, target in targets.iteritems():
+        for action in target.actions:
+            for output in action.outputs:
+                producers.setdefault(output, name)
+
+    graph = {}
+    for name, target in targets.iteritems():
+        dependencies = set(target.dependencies + target.dependencies_original)
+        inputs       = set(target.sources)
+        for action in target.actions:
+            inputs.update(action.inputs)
+        dependencies.update(producers[i] for i in inputs if i in producers)
+        dependencies.discard(name)
+        graph[name] = sorted(d for d in dependencies if d in targets)
+    return graph
+
+def get_build_order(graph):
+    remaining  = {name: len(dependencies) for name, dependencies in graph.iteritems()}
+    dependents = defaultdict(list)
+    for name, dependencies in graph.iteritems():
+        for dependency in dependencies:
+            dependents[dependency].append(name)
+
+    ready = sorted(name for name, count in remaining.iteritems() if count == 0)
+    order = []
+    while len(ready):
+        name = ready.pop()
+        order.append(name)
+        for dependent in dependents[name]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+
+    if len(order) != len(graph):
+        cycle = sorted(name for name in graph if remaining[name] > 0)
+        raise RuntimeError('Dependency cycle between: {}'.format(', '.join(cycle)))
+    return order
+
+def read_ninja_log(path):
+    '''
+    Return the start and end times, in milliseconds, of the most recent build
+    of each output listed in the '.ninja_log' at 'path'.
+    '''
+    intervals = {}
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 4:
+                continue
+            intervals[fields[3]] = (int(fields[0]), int(fields[1]))
+    return intervals
+
+def get_shared_consumers(targets):
+    '''
+    Return the targets sharing each object library that 'generate.py
+    --share-objects' may define, by the digest in its name: the sets of
+    targets of the same directory that compile the same source.
+    '''
+    compilers = defaultdict(set)
+    for name, target in targets.iteritems():
+        for source in target.sources:
+            if is_compiled(source):
+                compilers[(get_target_path(name), source)].add(name)
+
+    consumers = {}
+    for names in {frozenset(n) for n in compilers.itervalues() if len(n) > 1}:
+        if len(names) > MAX_SHARED_CONSUMERS:
+            continue
+        for size in range(2, len(names) + 1):
+            for subset in itertools.combinations(sorted(names), size):
+                digest = hashlib.sha1('\n'.join(subset)).hexdigest()[:8]
+                consumers[digest] = subset
+    return consumers
+
+def get_cmake_target(output):
+    '''
+    Return the name of the CMake target that compiles or links 'output', or
+    'None' if it is neither an object file nor a library or executable.
+    '''
+    match = OBJECT_DIRECTORY.search(output)
+    if match is None:
+        if output.startswith('CMakeFiles/') or output.endswith('.o'):
+            return None
+        return LINK_SUFFIXES.sub('', os.path.basename(output))
+
+    cmake_target = match.group(1)
+    for suffix in CATEGORY_SUFFIXES:
+        if cmake_target.endswith(suffix):
+            return cmake_target[:-len(suffix)]
+    return cmake_target
+
+def get_target_names(cmake_target, by_cmake_name, shared_consumers):
+    if cmake_target in by_cmake_name:
+        return (by_cmake_name[cmake_target],)
+
+    # 'lib<name>.a' and 'lib<name>.so'
+    if cmake_target.startswith('lib') and cmake_target[3:] in by_cmake_name:
+        return (by_cmake_name[cmake_target[3:]],)
+
+    match = SHARED_LIBRARY.match(cmake_target)
+    if match is not None:
+        if match.group(2) in shared_consumers:
+            return shared_consumers[match.group(2)]
+        if match.group(1) in by_cmake_name:
+            return (by_cmake_name[match.group(1)],)
+    return ()
+
+def get_measured_costs(targets, intervals):
+    '''
+    Attribute the duration of each build step in a '.ninja_log' to the target
+    that compiles or links its output or whose action produces it, in
+    seconds.  The steps of object libraries shared by several targets are
+    split evenly between them, and steps with several outputs are only
+    counted once.
+    '''
+    by_cmake_name    = {unqualify_name(name): name for name in targets}
+    shared_consumers = get_shared_consumers(targets)
+    by_output        = {}
+    for name, target in targets.iteritems():
+        for action in target.actions:
+            for output in action.outputs:
+                if output.startswith(BUILD_DIRECTORY):
+                    output = output[len(BUILD_DIRECTORY):]
+                by_output[output] = name
+
+    steps = set()
+    for output, interval in intervals.iteritems():
+        names = ()
+        if output in by_output:
+            names = (by_output[output],)
+        else:
+            cmake_target = get_cmake_target(output)
+            if cmake_target is not None:
+                names = get_target_names(cmake_target,
+                                         by_cmake_name,
+                                         shared_consumers)
+        if len(names):
+            steps.add((names, interval))
+
+    costs = defaultdict(float)
+    for names, (start, end) in steps:
+        for name in names:
+            costs[name] += (end - start) / 1000.0 / len(names)
+    return costs
+
+def report_platform(name, targets, intervals):
+    graph = get_graph(targets)
+    order = get_build_order(graph)
+
+    rows = {}
+    for target_name, target in targets.iteritems():
+        sources = [s for s in set(target.sources) if is_compiled(s)]
+        rows[target_name] = {
+            'type':              target.type,
+            'translation_units': len(sources),
+            'source_bytes':      get_source_bytes(target_name, sources),
+            'dependencies':      graph[target_name],
+        }
+
+    if intervals is None:
+        for row in rows.itervalues():
+            row['cost'] = row['source_bytes']
+    else:
+        costs = get_measured_costs(targets, intervals)
+        for target_name, row in rows.iteritems():
+            row['cost'] = costs.get(target_name, 0.0)
+
+    # The earliest time at which each target can finish if every target only
+    # starts once all of its dependencies have finished.
+    finish      = {}
+    predecessor = {}
+    for target_name in order:
+        start = 0
+        for dependency in graph[target_name]:
+            if finish[dependency] > start:
+                start                    = finish[dependency]
+                predecessor[target_name] = dependency
+        finish[target_name] = start + rows[target_name]['cost']
+
+    path = []
+    if len(finish):
+        current = max(sorted(finish), key=lambda n: finish[n])
+        while current is not None:
+            path.append(current)
+            current = predecessor.get(current)
+        path.reverse()
+
+    for target_name, row in rows.iteritems():
+        row['finish']        = finish[target_name]
+        row['critical_path'] = target_name in path
+
+    total    = sum(row['cost'] for row in rows.itervalues())
+    critical = finish[path[-1]] if len(path) else 0
+    return {
+        'platform':           name,
+        'unit':               'bytes' if intervals is None else 'seconds',
+        'translation_units':  sum(r['translation_units'] for r in rows.itervalues()),
+        'source_bytes':       sum(r['source_bytes'] for r in rows.itervalues()),
+        'total_cost':         total,
+        'critical_path_cost': critical,
+        'parallelism':        float(total) / critical if critical else 0.0,
+        'critical_path':      path,
+        'targets':            rows,
+    }
+
+def print_report(report, top):
+    unit = report['unit']
+    print('Platform: {}'.format(report['platform']))
+    print('  Targets:            {}'.format(len(report['targets'])))
+    print('  Translation units:  {}'.format(report['translation_units']))
+    print('  Source bytes:       {}'.format(report['source_bytes']))
+    print('  Total cost:         {} {}'.format(report['total_cost'], unit))
+    print('  Critical path cost: {} {}'.format(report['critical_path_cost'], unit))
+    print('  Parallelism:        {:.2f}'.format(report['parallelism']))
+
+    print('  Critical path:')
+    for name in report['critical_path']:
+        print('    {} ({} {})'.format(name, report['targets'][name]['cost'], unit))
+
+    rows = sorted(report['targets'].iteritems(),
+                  key=lambda item: (-item[1]['cost'], item[0]))
+    print('  Most expensive targets:')
+    print('    {:>12} {:>6} {:>12}  {}'.format(unit, 'TUs', 'bytes', 'target'))
+    for name, row in rows[:top]:
+        print('    {:>12} {:>6} {:>12} {}{}'.format(row['cost'],
+                                                  row['translation_units'],
+                                                  row['source_bytes'],
+                                                  '*' if row['critical_path'] else ' ',
+                                                  name))
+    print()
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+               description='Report the build cost of each target of a GYP '
+                           'analysis and the critical path through the build.')
+    parser.add_argument('--analysis',
+                        help='analysis file or sharded analysis store to read '
+                             '(default: {} if it exists, otherwise {})'.format(
+                                                  ANALYSIS_STORE, ANALYSIS_FILE))
+    parser.add_argument('--platform',
+                        action='append',
+                        help='only report this platform (may be repeated)')
+    parser.add_argument('--ninja-log',
+                        help='weight targets by the build times in this '
+                             '.ninja_log instead of by their source bytes')
+    parser.add_argument('--json',
+                        help='also write the full report to this file')
+    parser.add_argument('--top',
+                        type=int,
+                        default=20,
+                        help='number of targets to list (default: %(default)s)')
+    return parser.parse_args()
+
+def main():
+    options = parse_args()
+    if options.analysis is None:
+        options.analysis = ANALYSIS_FILE
+        if store.is_store(ANALYSIS_STORE):
+            options.analysis = ANALYSIS_STORE
+
+    intervals = None
+    if options.ninja_log:
+        intervals = read_ninja_log(options.ninja_log)
+
+    reports = {}
+    for name, platform in sorted(model.load(options.analysis).iteritems()):
+        if options.platform and name not in options.platform:
+            continue
+
+        targets = dict(platform.targets.iteritems())
+        reports[name] = report_platform(name, targets, intervals)
+        print_report(reports[name], options.top)
+
+    if options.json:
+        store.dump_json(reports, options.json, pretty=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
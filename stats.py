@@ -0,0 +1,70 @@
+import time
+import cProfile
+import contextlib
+
+import store
+
+class Stats(object):
+    '''
+    The wall-clock time spent in each phase of a run and the counts recorded
+    for each target, reported as JSON so that runs can be compared.
+    '''
+    def __init__(self):
+        self.phases  = {}
+        self.targets = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.time() - start
+
+    def count(self, platform, name, counts):
+        self.targets.setdefault(platform, {})[name] = counts
+
+    def update(self, report):
+        '''
+        Add the phases and targets of a previous 'report' (e.g. of another
+        platform) that this run did not record.
+        '''
+        for name, seconds in report['phases'].iteritems():
+            self.phases.setdefault(name, seconds)
+        for platform, targets in report['targets'].iteritems():
+            self.targets.setdefault(platform, targets)
+
+    def get_report(self):
+        totals = {}
+        for targets in self.targets.itervalues():
+            for counts in targets.itervalues():
+                for key, value in counts.iteritems():
+                    totals[key] = totals.get(key, 0) + value
+
+        return {
+            'phases':  self.phases,
+            'total':   sum(self.phases.itervalues()),
+            'counts':  totals,
+            'targets': self.targets,
+        }
+
+    def dump(self, path):
+        store.dump_json(self.get_report(), path, pretty=True)
+
+@contextlib.contextmanager
+def profiled(path):
+    '''
+    Profile the context with cProfile and write the statistics to 'path',
+    for 'python -m pstats' or 'snakeviz', unless 'path' is empty.
+    '''
+    if not path:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
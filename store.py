@@ -0,0 +1,130 @@
+import os
+import time
+import gzip
+import json
+import errno
+import shutil
+import hashlib
+import contextlib
+
+INDEX_FILE   = 'index.json'
+VERSION      = 1
+LOCK_TIMEOUT = 600
+
+@contextlib.contextmanager
+def locked(path, timeout=LOCK_TIMEOUT):
+    '''
+    Hold an exclusive lock on 'path' for the duration of the context, using a
+    '<path>.lock' file so that it also works on shared network directories.
+    '''
+    lock     = path + '.lock'
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            if time.time() > deadline:
+                raise RuntimeError(
+                         'Timed out waiting for {}; remove it if no other '
+                         'analysis is running'.format(lock))
+            time.sleep(0.1)
+
+    try:
+        os.write(fd, str(os.getpid()))
+        os.close(fd)
+        yield
+    finally:
+        os.remove(lock)
+
+def replace_file(source, destination):
+    try:
+        os.rename(source, destination)
+    except OSError:
+        # Windows does not allow renaming over an existing file.
+        os.remove(destination)
+        os.rename(source, destination)
+
+def dump_json(data, path, compress=False, cls=None, pretty=False):
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    opener    = gzip.open if compress else open
+    with opener(temporary, 'wb') as f:
+        if pretty:
+            json.dump(data, f,
+                      sort_keys=True,
+                      separators=(',', ': '),
+                      indent=4,
+                      cls=cls)
+        else:
+            json.dump(data, f, sort_keys=True, separators=(',', ':'), cls=cls)
+    replace_file(temporary, path)
+
+def load_json(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return json.load(f)
+
+def get_shard_name(target_name, compress):
+    digest = hashlib.sha1(target_name.encode('utf-8')).hexdigest()[:16]
+    return digest + ('.json.gz' if compress else '.json')
+
+def read_index(root):
+    path = os.path.join(root, INDEX_FILE)
+    if not os.path.isfile(path):
+        return {'version': VERSION, 'platforms': {}}
+
+    index = load_json(path)
+    if index.get('version') != VERSION:
+        raise RuntimeError('Unsupported analysis store version: {}'.format(
+                                                           index.get('version')))
+    return index
+
+def write_index(root, index):
+    dump_json(index, os.path.join(root, INDEX_FILE))
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+def write_platform(root, platform, targets, analysis, compress=False, cls=None):
+    '''
+    Write the analysis of 'platform' to the store at 'root', one file per
+    target plus a per-platform index holding the analysis, replacing any
+    previous analysis of the same platform.
+    '''
+    staging = os.path.join(root, '.{}.{}'.format(platform, os.getpid()))
+    if os.path.isdir(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+
+    shards = {}
+    for name, target in targets.iteritems():
+        shards[name] = get_shard_name(name, compress)
+        dump_json(target, os.path.join(staging, shards[name]), compress, cls)
+
+    dump_json({'analysis': analysis, 'targets': shards},
+              os.path.join(staging, INDEX_FILE),
+              compress=False,
+              cls=cls)
+
+    directory = os.path.join(root, platform)
+    if os.path.isdir(directory):
+        retired = staging + '.old'
+        os.rename(directory, retired)
+        os.rename(staging, directory)
+        shutil.rmtree(retired)
+    else:
+        os.rename(staging, directory)
+
+    index_path = os.path.join(root, INDEX_FILE)
+    with locked(index_path):
+        index = read_index(root)
+        index['platforms'][platform] = platform
+        write_index(root, index)
+
+def read_platform(directory):
+    return load_json(os.path.join(directory, INDEX_FILE))
+
+def read_target(directory, shard):
+    return load_json(os.path.join(directory, shard))
@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_MASK        = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+EVENT = struct.Struct('iIII')
+
+class InotifyWatcher(object):
+    '''
+    Wait for changes to files using inotify.  The directories of the files
+    are watched rather than the files, so that files replaced by renaming
+    another file over them are still noticed.
+    '''
+    def __init__(self, paths):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+        self._fd = libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+
+        self._names = {}
+        for path in paths:
+            directory = os.path.dirname(os.path.abspath(path))
+            self._names.setdefault(directory, set()).add(os.path.basename(path))
+
+        self._directories = {}
+        for directory in self._names:
+            descriptor = libc.inotify_add_watch(self._fd, directory.encode('utf-8'), IN_MASK)
+            if descriptor < 0:
+                error = ctypes.get_errno()
+                os.close(self._fd)
+                raise OSError(error, 'Cannot watch {}'.format(directory))
+            self._directories[descriptor] = directory
+
+    def wait(self, timeout):
+        '''
+        Return whether any of the files changed within 'timeout' seconds.
+        '''
+        try:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        if len(ready) == 0:
+            return False
+
+        data    = os.read(self._fd, 1 << 16)
+        offset  = 0
+        changed = False
+        while offset < len(data):
+            descriptor, _, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name    = data[offset:offset + length].rstrip(b'\0').decode('utf-8')
+            offset += length
+
+            directory = self._directories.get(descriptor)
+            if directory is not None and name in self._names[directory]:
+                changed = True
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher(object):
+    '''
+    Wait for changes to files by comparing their modification time, size and
+    inode every 'interval' seconds.
+    '''
+    def __init__(self, paths, interval):
+        self._paths    = list(paths)
+        self._interval = interval
+        self._states   = self._get_states()
+
+    def _get_states(self):
+        states = []
+        for path in self._paths:
+            try:
+                status = os.stat(path)
+                states.append((status.st_mtime, status.st_size, status.st_ino))
+            except OSError:
+                states.append(None)
+        return states
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            states = self._get_states()
+            if states != self._states:
+                self._states = states
+                return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self._interval, remaining))
+
+    def close(self):
+        pass
+
+def get_watcher(paths, interval):
+    '''
+    Return an 'InotifyWatcher' for 'paths' if inotify is available, and a
+    'PollingWatcher' checking them every 'interval' seconds otherwise.
+    '''
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):
+            # AttributeError: a C library without inotify.
+            pass
+    return PollingWatcher(paths, interval)
+
+def wait_for_change(watcher, quiet):
+    '''
+    Block until the watched files change, and then until they have not
+    changed for 'quiet' seconds, so that a GYP run that writes the analysis
+    of several platforms only triggers one regeneration.
+    '''
+    while not watcher.wait(3600):
+        pass
+    while watcher.wait(quiet):
+        pass